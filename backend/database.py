@@ -1,6 +1,6 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Enum as SQLEnum, Table
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Enum as SQLEnum, Table, UniqueConstraint
 from sqlalchemy.sql import func
 import enum
 import os
@@ -111,10 +111,51 @@ class MessageLog(Base):
     sender_name = Column(String, nullable=True)
     message_content = Column(Text, nullable=True)
     attachment_path = Column(String, nullable=True)
-    status = Column(String)  # SENT, FAILED, PENDING
+    status = Column(String)  # SENT, FAILED, PENDING, QUEUED (waiting in the outbound email spool)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     scheduled_for = Column(DateTime(timezone=True), nullable=True)
 
+class TelegramUpdateState(Base):
+    """Last handled incoming message per Telegram account and chat (used to catch up after restart)"""
+    __tablename__ = "telegram_update_state"
+    __table_args__ = (UniqueConstraint("account_id", "chat_id"),)
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), index=True)
+    chat_id = Column(String, nullable=False)
+    last_message_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class ImapSyncState(Base):
+    """UIDVALIDITY and highest processed UID per IMAP account and mailbox (incremental sync)"""
+    __tablename__ = "imap_sync_state"
+    __table_args__ = (UniqueConstraint("account_id", "mailbox"),)
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), index=True)
+    mailbox = Column(String, nullable=False, default="INBOX")
+    uidvalidity = Column(Integer, nullable=False)
+    last_uid = Column(Integer, nullable=False)
+    # Highest unread UID processed by an unfinished resync (last_uid then holds its baseline)
+    resync_uid = Column(Integer, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class OutboundEmail(Base):
+    """Outbound email spool: queued instant email forwards, delivered and retried by background workers"""
+    __tablename__ = "outbound_emails"
+    id = Column(Integer, primary_key=True, index=True)
+    message_log_id = Column(Integer, ForeignKey("message_logs.id"), nullable=True)
+    smtp_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)  # Destination account to send through
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=True)
+    body = Column(Text, nullable=True)
+    attachments_json = Column(Text, nullable=True)  # Media store refs
+    status = Column(String, default="QUEUED", index=True)  # QUEUED, SENDING, SENT, DEAD
+    attempts = Column(Integer, default=0)
+    parts_sent = Column(Integer, default=0)  # Messages of a split email already delivered, skipped on retry
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class ScheduleConfig(Base):
     """Global schedule configuration (e.g., for legacy digests or master switch)"""
     __tablename__ = "schedule_config"
@@ -14,6 +14,12 @@ from routers.accounts import router as accounts_router
 from services.account_manager import account_manager
 from services.scheduler import start_scheduler
 from services.imap_service import imap_service
+from services.ingest_queue import ingest_queue
+from services.log_writer import log_writer
+from services.mime_parser import mime_parser
+from services.media_store import media_store
+from services.smtp_pool import smtp_pools
+from services.email_spool import email_spool
 import os
 import logging
 from logging.handlers import RotatingFileHandler
@@ -44,16 +50,29 @@ async def lifespan(app: FastAPI):
     await create_initial_admin()
     await create_initial_settings()
     
-    # Initialize Account Manager, Scheduler and IMAP service
+    # Initialize Log writer, Ingest workers, Account Manager, Scheduler and IMAP service
+    await log_writer.start()
+    await ingest_queue.start()
+    await media_store.start()
+    await email_spool.start()
     await account_manager.start_all()
+    # Accounts are running or listed as starting now, so spilled messages find their owner
+    ingest_queue.release_spill()
     start_scheduler()
     await imap_service.start()
     
     yield
     # Shutdown
     print("Shutting down...")
+    await ingest_queue.stop()
     await account_manager.stop_all()
     await imap_service.stop()
+    mime_parser.shutdown()
+    await media_store.stop()
+    await email_spool.stop()
+    await smtp_pools.close_all()
+    # Last: commit every buffered MessageLog row before the process exits
+    await log_writer.stop()
 
 app = FastAPI(lifespan=lifespan, title="messenger2mail Admin Panel")
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
 import os
 import json
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -126,9 +126,8 @@ async def send_code(
         service = TelegramService(data.account_id)
         account_manager.telegram_services[data.account_id] = service
         # Start only basic client connection
-        from database import AppSettings
-        s_res = await db.execute(select(AppSettings).where(AppSettings.id == 1))
-        settings = s_res.scalar_one_or_none()
+        from services.settings_cache import settings_cache
+        settings = await settings_cache.get()
         if not settings: raise HTTPException(status_code=500, detail="Global settings missing")
         service.api_id = settings.telegram_api_id
         service.api_hash = settings.telegram_api_hash
@@ -161,10 +160,14 @@ async def login_telegram(
 @router.get("/{account_id}/dialogs")
 async def get_account_dialogs(
     account_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    search: Optional[str] = None,
     db: AsyncSession = Depends(get_db),
     current_user: AdminUser = Depends(get_current_user)
 ):
-    """Fetch available chats for a specific Telegram account"""
+    """Fetch available chats for a specific Telegram account (served from the dialog cache)"""
     client = await account_manager.get_client(account_id)
     if not client:
         # Try to start it
@@ -173,17 +176,14 @@ async def get_account_dialogs(
         if account and account.account_type == AccountType.TELEGRAM:
             client = await account_manager.start_telegram_account(account)
     
-    if not client:
+    service = account_manager.telegram_services.get(account_id)
+    if not client or not service:
         raise HTTPException(status_code=404, detail="Client not active")
         
     try:
-        dialogs = []
-        async for dialog in client.iter_dialogs():
-            dialogs.append({
-                "source_id": str(dialog.id),
-                "source_name": dialog.name,
-                "source_type": "channel" if dialog.is_channel else "group" if dialog.is_group else "private"
-            })
+        await service.dialogs.ensure_loaded(client)
+        dialogs, total = service.dialogs.query(limit=limit, offset=offset, search=search)
+        response.headers["X-Total-Count"] = str(total)
         return dialogs
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -7,8 +7,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from database import get_db, AppSettings
 from routers.auth import get_current_user, AdminUser
+from services.settings_cache import settings_cache
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict, Any
 import os
 import shutil
 
@@ -58,6 +59,23 @@ class SystemStatsResponse(BaseModel):
     messages_processed: int
     telegram_connected: bool
     active_rules: int
+    rule_index: Optional[Dict[str, Any]] = None
+    ingest_queue: Optional[Dict[str, Any]] = None
+    log_writer: Optional[Dict[str, Any]] = None
+    sender_cache: Optional[Dict[str, Any]] = None
+    native_forward: Optional[Dict[str, Any]] = None
+    send_lanes: Optional[Dict[str, Any]] = None
+    telegram_startup: Optional[Dict[str, Any]] = None
+    catch_up: Optional[Dict[str, Any]] = None
+    dialog_cache: Optional[Dict[str, Any]] = None
+    media_downloads: Optional[Dict[str, Any]] = None
+    imap_accounts: Optional[Dict[str, Any]] = None
+    mime_parsing: Optional[Dict[str, Any]] = None
+    media_store: Optional[Dict[str, Any]] = None
+    smtp_pools: Optional[Dict[str, Any]] = None
+    settings_cache: Optional[Dict[str, Any]] = None
+    email_spool: Optional[Dict[str, Any]] = None
+    email_delivery: Optional[Dict[str, Any]] = None
 
 # App Settings Endpoints
 @router.get("/settings", response_model=AppSettingsResponse)
@@ -74,6 +92,7 @@ async def get_app_settings(
         db.add(settings)
         await db.commit()
         await db.refresh(settings)
+        settings_cache.update(settings)
     
     # Add calculated field
     settings.setup_complete = bool(settings.telegram_api_id and settings.telegram_api_hash)
@@ -101,6 +120,7 @@ async def update_app_settings(
     
     await db.commit()
     await db.refresh(settings)
+    settings_cache.update(settings)
     settings.setup_complete = bool(settings.telegram_api_id and settings.telegram_api_hash)
     return settings
 
@@ -112,7 +132,19 @@ async def get_system_stats(
     """Get system-wide statistics for the dashboard"""
     from database import Account, ForwardingRule, MessageLog
     from sqlalchemy import func
-    
+    from services.rule_index import rule_index
+    from services.ingest_queue import ingest_queue
+    from services.log_writer import log_writer
+    from services.account_manager import account_manager
+    from services.telegram_forward import native_forwarder
+    from services.send_scheduler import send_scheduler
+    from services.media_handle import download_stats
+    from services.imap_service import imap_service
+    from services.mime_parser import mime_parser
+    from services.media_store import media_store
+    from services.smtp_pool import smtp_pools
+    from services.email_spool import email_spool
+    from services.email_service import email_service
     acc_count = await db.scalar(select(func.count(Account.id)))
     rule_count = await db.scalar(select(func.count(ForwardingRule.id)))
     active_rules = await db.scalar(select(func.count(ForwardingRule.id)).where(ForwardingRule.enabled == True))
@@ -126,9 +158,47 @@ async def get_system_stats(
         "rules_count": rule_count or 0,
         "active_rules": active_rules or 0,
         "messages_processed": msg_count or 0,
-        "telegram_connected": bool(tg_active)
+        "telegram_connected": bool(tg_active),
+        "rule_index": rule_index.get_stats(),
+        "ingest_queue": ingest_queue.get_stats(),
+        "log_writer": log_writer.get_stats(),
+        "sender_cache": {
+            str(acc_id): service.sender_cache.get_stats()
+            for acc_id, service in account_manager.telegram_services.items()
+        },
+        "native_forward": native_forwarder.get_stats(),
+        "send_lanes": send_scheduler.get_stats(),
+        "telegram_startup": {
+            "ready": sorted(account_manager.telegram_services),
+            "starting": sorted(account_manager.starting),
+            "errors": {str(acc_id): err for acc_id, err in account_manager.start_errors.items()}
+        },
+        "catch_up": {
+            str(acc_id): service.catchup_stats
+            for acc_id, service in account_manager.telegram_services.items()
+        },
+        "dialog_cache": {
+            str(acc_id): service.dialogs.get_stats()
+            for acc_id, service in account_manager.telegram_services.items()
+        },
+        "media_downloads": dict(download_stats),
+        "imap_accounts": imap_service.get_status(),
+        "mime_parsing": mime_parser.get_stats(),
+        "media_store": media_store.get_stats(),
+        "smtp_pools": smtp_pools.get_stats(),
+        "settings_cache": settings_cache.get_stats(),
+        "email_spool": email_spool.get_stats(),
+        "email_delivery": email_service.get_stats()
     }
 
+@router.get("/imap")
+async def get_imap_status(
+    current_user: AdminUser = Depends(get_current_user)
+):
+    """Per-account IMAP polling status (last poll latency, errors, next poll)"""
+    from services.imap_service import imap_service
+    return imap_service.get_status()
+
 # SSL Certificate Management
 @router.post("/ssl/upload")
 async def upload_ssl_certificates(
@@ -168,6 +238,7 @@ async def upload_ssl_certificates(
     settings.ssl_key_path = privkey_path
     
     await db.commit()
+    settings_cache.invalidate()
     
     return {"status": "uploaded", "ssl_enabled": True}
 
@@ -180,8 +251,7 @@ async def get_ssl_info(
     current_user: AdminUser = Depends(get_current_user)
 ):
     """Get SSL certificate details"""
-    result = await db.execute(select(AppSettings).where(AppSettings.id == 1))
-    settings = result.scalar_one_or_none()
+    settings = await settings_cache.get()
     
     cert_path = settings.ssl_cert_path if settings and settings.ssl_cert_path else "/app/ssl/fullchain.pem"
     
@@ -235,6 +305,7 @@ async def remove_ssl(
         settings.ssl_key_path = None
         
         await db.commit()
+        settings_cache.invalidate()
     
     return {"status": "removed"}
 
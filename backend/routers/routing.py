@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete
 from database import get_db, Source, SourceType, ForwardingRule
 from routers.auth import get_current_user, AdminUser
+from services.rule_index import rule_index
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 
@@ -182,6 +183,7 @@ async def create_rule(
     try:
         await db.commit()
         await db.refresh(rule)
+        rule_index.upsert(rule)
         return rule
     except Exception as e:
         await db.rollback()
@@ -205,6 +207,7 @@ async def update_rule(
     
     await db.commit()
     await db.refresh(rule)
+    rule_index.upsert(rule)
     return rule
 
 @router.delete("/rules/{rule_id}")
@@ -216,4 +219,5 @@ async def delete_rule(
     """Delete a forwarding rule"""
     await db.execute(delete(ForwardingRule).where(ForwardingRule.id == rule_id))
     await db.commit()
+    rule_index.remove(rule_id)
     return {"status": "deleted"}
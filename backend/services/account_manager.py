@@ -6,7 +6,8 @@ import json
 import os
 from typing import Dict, Any, Optional
 from telethon import TelegramClient
-from database import AsyncSessionLocal, Account, AccountType, AppSettings
+from database import AsyncSessionLocal, Account, AccountType
+from services.settings_cache import settings_cache
 from sqlalchemy import select
 from services.telegram_client import TelegramService
 
@@ -14,34 +15,94 @@ from services.telegram_client import TelegramService
 SESSIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sessions')
 os.makedirs(SESSIONS_DIR, exist_ok=True)
 
+# Startup tuning: how many accounts connect at once, and how long one may take
+STARTUP_CONCURRENCY = int(os.getenv("TELEGRAM_STARTUP_CONCURRENCY", 5))
+CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", 30))
+RETRY_BASE_DELAY = float(os.getenv("TELEGRAM_RETRY_BASE_DELAY", 10))
+RETRY_MAX_DELAY = float(os.getenv("TELEGRAM_RETRY_MAX_DELAY", 600))
+
 class AccountManager:
     def __init__(self):
         self.telegram_services: Dict[int, TelegramService] = {}
         self.running = False
+        self.starting: Dict[int, asyncio.Task] = {}
+        self.start_errors: Dict[int, str] = {}
 
     async def start_all(self):
-        """Start all active accounts"""
+        """
+        Start all active accounts concurrently (at most STARTUP_CONCURRENCY at a time).
+        Returns as soon as the first account is ready or every first attempt has
+        finished; failed accounts keep retrying in the background with backoff.
+        """
         if self.running:
             return
         self.running = True
         
         async with AsyncSessionLocal() as db:
-            result = await db.execute(select(Account).where(Account.is_active == True))
+            result = await db.execute(select(Account).where(Account.is_active == True, Account.account_type == AccountType.TELEGRAM))
             accounts = result.scalars().all()
-            
-            for account in accounts:
-                if account.account_type == AccountType.TELEGRAM:
-                    await self.start_telegram_account(account)
-        
-        print(f"AccountManager: Started {len(self.telegram_services)} Telegram accounts.")
+        # One snapshot for all accounts
+        settings = await settings_cache.get()
+
+        if not accounts:
+            print("AccountManager: No Telegram accounts to start.")
+            return
+
+        semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+        first_ready = asyncio.Event()
+        attempts = {"done": 0}
+
+        def on_first_attempt(ok: bool):
+            attempts["done"] += 1
+            if ok or attempts["done"] == len(accounts):
+                first_ready.set()
 
-    async def start_telegram_account(self, account: Account):
+        for account in accounts:
+            self.starting[account.id] = asyncio.create_task(
+                self._start_with_retry(account, settings, semaphore, on_first_attempt)
+            )
+
+        await first_ready.wait()
+        print(f"AccountManager: {len(self.telegram_services)}/{len(accounts)} Telegram accounts ready, {len(self.starting)} still starting.")
+
+    async def _start_with_retry(self, account: Account, settings, semaphore: asyncio.Semaphore, on_first_attempt):
+        delay = RETRY_BASE_DELAY
+        first = True
+        try:
+            while self.running:
+                try:
+                    async with semaphore:
+                        client = await self.start_telegram_account(account, settings, timeout=CONNECT_TIMEOUT)
+                    self.start_errors.pop(account.id, None)
+                    if first: on_first_attempt(client is not None)
+                    return
+                except Exception as e:
+                    error = "connect timeout" if isinstance(e, asyncio.TimeoutError) else str(e)
+                    self.start_errors[account.id] = error
+                    print(f"AccountManager: Telegram account {account.id} failed to start ({error}), retrying in {int(delay)}s")
+                if first:
+                    first = False
+                    on_first_attempt(False)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_DELAY)
+                settings = await settings_cache.get()  # Pick up API credentials fixed in the meantime
+        finally:
+            self.starting.pop(account.id, None)
+
+    async def start_telegram_account(self, account: Account, settings=None, timeout: Optional[float] = None):
         """Initialize and start a specific Telegram account service"""
         if account.id in self.telegram_services:
             return self.telegram_services[account.id].client
 
         service = TelegramService(account.id)
-        await service.start()
+        try:
+            await asyncio.wait_for(service.start(settings=settings, account=account), timeout)
+        except BaseException:
+            # Don't leak a half-open connection from a timed out or failed start
+            if service.client:
+                try: await service.client.disconnect()
+                except Exception: pass
+            raise
         
         if service.client:
             self.telegram_services[account.id] = service
@@ -56,9 +117,12 @@ class AccountManager:
     async def stop_all(self):
         """Stop all managed clients"""
         self.running = False
+        for task in list(self.starting.values()):
+            task.cancel()
+        self.starting.clear()
         for service in self.telegram_services.values():
-            if service.client:
-                await service.client.disconnect()
+            # Persists the per-chat update state used for catch-up on next start
+            await service.stop()
         self.telegram_services.clear()
 
 account_manager = AccountManager()
@@ -0,0 +1,112 @@
+"""
+Dialog Cache - Per-account in-memory dialog list kept fresh by update events
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from telethon.tl.types import Channel as TelegramChannel, Chat
+from telethon.utils import get_display_name
+
+# Full reload from Telegram after this long, to pick up renames/leaves that events don't cover
+DIALOG_CACHE_MAX_AGE = int(os.getenv("DIALOG_CACHE_MAX_AGE", 3600))
+
+def dialog_type(entity) -> str:
+    """Same classification as iterating dialogs: channel (incl. megagroups), group or private"""
+    if isinstance(entity, TelegramChannel):
+        return "channel"
+    if isinstance(entity, Chat):
+        return "group"
+    return "private"
+
+
+class DialogCache:
+    """
+    Dialogs of one Telegram account ordered by last activity (most recent last).
+    Loaded once with iter_dialogs(), then patched incrementally from
+    NewMessage/ChatAction events instead of re-listing on every request.
+    """
+    def __init__(self):
+        self._dialogs: "OrderedDict[str, dict]" = OrderedDict()
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self.full_loads = 0
+        self.incremental_updates = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    @property
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= DIALOG_CACHE_MAX_AGE
+
+    async def ensure_loaded(self, client, on_dialog=None):
+        """Load on first use; afterwards serve from memory and refresh stale data in the background"""
+        if not self.loaded:
+            await self.reload(client, on_dialog)
+        elif self.stale and not self._lock.locked():
+            asyncio.create_task(self.reload(client))
+
+    async def reload(self, client, on_dialog=None):
+        """Full listing from Telegram; on_dialog(dialog) lets callers reuse the same pass"""
+        async with self._lock:
+            if self.loaded and not self.stale:
+                return
+            dialogs = []
+            async for dialog in client.iter_dialogs():
+                if on_dialog:
+                    on_dialog(dialog)
+                dialogs.append({
+                    "source_id": str(dialog.id),
+                    "source_name": dialog.name,
+                    "source_type": "channel" if dialog.is_channel else "group" if dialog.is_group else "private"
+                })
+            fresh = OrderedDict()
+            # iter_dialogs yields most recent first; we keep most recent last
+            for entry in reversed(dialogs):
+                fresh[entry["source_id"]] = entry
+            self._dialogs = fresh
+            self._loaded_at = time.monotonic()
+            self.full_loads += 1
+
+    def touch(self, chat_id: str, entity=None) -> bool:
+        """Move a chat to the top; returns False if the chat is unknown and no entity was given"""
+        entry = self._dialogs.get(chat_id)
+        if entry is None:
+            if entity is None:
+                return False
+            entry = {"source_id": chat_id, "source_name": get_display_name(entity), "source_type": dialog_type(entity)}
+            self._dialogs[chat_id] = entry
+            self.incremental_updates += 1
+        elif entity is not None:
+            entry["source_name"] = get_display_name(entity)
+        self._dialogs.move_to_end(chat_id)
+        return True
+
+    def remove(self, chat_id: str):
+        if self._dialogs.pop(chat_id, None) is not None:
+            self.incremental_updates += 1
+
+    def items(self) -> List[dict]:
+        """All cached dialogs, most recent first"""
+        return list(reversed(self._dialogs.values()))
+
+    def query(self, limit: Optional[int] = None, offset: int = 0, search: Optional[str] = None) -> Tuple[List[dict], int]:
+        """Page through the cached dialogs; returns (page, total matching)"""
+        dialogs = self.items()
+        if search:
+            needle = search.lower()
+            dialogs = [d for d in dialogs if needle in (d["source_name"] or "").lower() or needle in d["source_id"]]
+        total = len(dialogs)
+        end = offset + limit if limit is not None else None
+        return dialogs[offset:end], total
+
+    def get_stats(self) -> dict:
+        return {
+            "dialogs": len(self._dialogs),
+            "loaded": self.loaded,
+            "full_loads": self.full_loads,
+            "incremental_updates": self.incremental_updates,
+        }
@@ -1,109 +1,159 @@
-import aiosmtplib
-from email.message import EmailMessage
-from email.utils import formatdate
+import asyncio
+import json
 import os
-import mimetypes
-from database import AsyncSessionLocal, AppSettings
-from sqlalchemy import select
+from html import escape
+from typing import Optional, Tuple
+from database import AsyncSessionLocal, Account, AccountType
+from services.media_store import media_store
+from services.smtp_pool import smtp_pools, SMTPPool, SMTP_POOL_SIZE, SMTP_RATE_PER_MINUTE
+from services.settings_cache import settings_cache
+from services.mime_writer import encoded_size, plan_batches, write_message
+
+# Largest message (after base64) we hand to the SMTP server; most providers cap at 20-25 MB
+EMAIL_MAX_MESSAGE_MB = int(os.getenv("EMAIL_MAX_MESSAGE_MB", 20))
+
+class SMTPNotConfigured(Exception):
+    pass
+
+def _account_pool(account: Account) -> Optional[Tuple[SMTPPool, str]]:
+    """Pool and From address for an EMAIL_SMTP account, None if it has no usable credentials"""
+    if account.account_type != AccountType.EMAIL_SMTP or not account.credentials_json:
+        return None
+    try:
+        creds = json.loads(account.credentials_json)
+        port = int(creds.get("port", 465))
+        size = int(creds.get("max_connections", SMTP_POOL_SIZE))
+        rate = float(creds.get("rate_per_minute", SMTP_RATE_PER_MINUTE))
+    except (ValueError, TypeError):
+        return None
+    host = creds.get("host")
+    user = creds.get("user") or creds.get("username")
+    password = creds.get("password")
+    if not host or not user or not password:
+        return None
+    # Accounts are verified with SMTP_SSL, so implicit TLS unless told otherwise
+    use_tls = bool(creds.get("ssl", port == 465))
+    pool = smtp_pools.get(host, port, user, password, max(1, size), use_tls, rate)
+    return pool, creds.get("from") or user
 
 class EmailService:
-    async def get_settings(self):
-        async with AsyncSessionLocal() as db:
-            result = await db.execute(select(AppSettings).where(AppSettings.id == 1))
-            return result.scalar_one_or_none()
+    def __init__(self):
+        self.stats = {"sent": 0, "follow_ups": 0, "dropped_attachments": 0}
 
-    async def send_html_digest(self, to_email: str, subject: str, html_body: str, attachments: list = None):
-        """Send a rich HTML digest email with optional attachments"""
-        settings = await self.get_settings()
-        if not settings or not settings.smtp_username or not settings.smtp_password:
-            print("SMTP Credentials not set in database.")
-            return False
+    async def get_settings(self):
+        return await settings_cache.get()
 
-        message = EmailMessage()
-        message["From"] = settings.smtp_username
-        message["To"] = to_email
-        message["Subject"] = subject
-        message["Date"] = formatdate(localtime=True)
-        # Fix: Content-Type is handled by add_alternative and add_attachment
-        message.set_content("Please use an HTML compatible email client to view this message.")
-        message.add_alternative(html_body, subtype="html")
-
-        if attachments:
-            for file_path in attachments:
-                if not file_path or not os.path.exists(file_path):
-                    continue
-                
-                ctype, encoding = mimetypes.guess_type(file_path)
-                if ctype is None or encoding is not None:
-                    ctype = "application/octet-stream"
-                
-                if "/" in ctype:
-                    maintype, subtype = ctype.split("/", 1)
-                else:
-                    maintype, subtype = "application", "octet-stream"
-                
-                try:
-                    with open(file_path, "rb") as f:
-                        file_data = f.read()
-                        message.add_attachment(
-                            file_data,
-                            maintype=maintype,
-                            subtype=subtype,
-                            filename=os.path.basename(file_path)
-                        )
-                except Exception as e:
-                    print(f"Failed to attach {file_path}: {e}")
+    def get_pool(self, settings) -> SMTPPool:
+        """Persistent connections to the configured SMTP server (STARTTLS + AUTH done once per connection)"""
+        return smtp_pools.get(settings.smtp_server, settings.smtp_port or 587, settings.smtp_username, settings.smtp_password)
 
+    async def send_html_digest(self, to_email: str, subject: str, html_body: str, attachments: list = None,
+                               smtp_account_id: Optional[int] = None):
+        """Send a rich HTML digest email with optional attachments"""
+        sent = []
+        async def part_sent(number: int, total: int):
+            sent.append(number)
         try:
-            await aiosmtplib.send(
-                message,
-                hostname=settings.smtp_server,
-                port=settings.smtp_port or 587,
-                start_tls=True,
-                username=settings.smtp_username,
-                password=settings.smtp_password,
-            )
+            await self._deliver(to_email, subject, "Please use an HTML compatible email client to view this message.",
+                                html_body, attachments, smtp_account_id, on_part_sent=part_sent)
             return True
+        except SMTPNotConfigured as e:
+            print(e)
+            return False
         except Exception as e:
+            if sent:
+                # The digest itself went out: sending it again for a lost follow-up would repeat every entry
+                print(f"Digest email sent, but attachments after part {sent[-1]} failed: {e}")
+                return True
             print(f"Failed to send digest email: {e}")
             return False
 
-    async def send_email(self, to_email: str, subject: str, body: str, attachments: list = None):
-        """Standard email with optional attachments"""
+    async def route_for(self, smtp_account_id: Optional[int] = None) -> Tuple[SMTPPool, str]:
+        """
+        Pool and From address to send through: the destination account's own SMTP
+        server when it is an EMAIL_SMTP account with credentials, else the global settings.
+        """
+        if smtp_account_id is not None:
+            async with AsyncSessionLocal() as db:
+                account = await db.get(Account, smtp_account_id)
+            route = _account_pool(account) if account else None
+            if route:
+                return route
         settings = await self.get_settings()
         if not settings or not settings.smtp_username or not settings.smtp_password:
-            print("SMTP Credentials not set in database.")
-            return False
+            raise SMTPNotConfigured("SMTP Credentials not set in database.")
+        return self.get_pool(settings), settings.smtp_username
 
-        message = EmailMessage()
-        message["From"] = settings.smtp_username
-        message["To"] = to_email
-        message["Subject"] = subject
-        message.set_content(body)
-
-        if attachments:
-            for file_path in attachments:
-                if not file_path or not os.path.exists(file_path):
-                    continue
-                ctype, _ = mimetypes.guess_type(file_path)
-                maintype, subtype = (ctype or "application/octet-stream").split("/", 1)
-                with open(file_path, "rb") as f:
-                    message.add_attachment(f.read(), maintype=maintype, subtype=subtype, filename=os.path.basename(file_path))
+    async def server_key(self, smtp_account_id: Optional[int] = None) -> str:
+        """Identifies the SMTP server mail goes through (for per-server concurrency limits)"""
+        pool, _ = await self.route_for(smtp_account_id)
+        return f"{pool.hostname}:{pool.port}/{pool.username}"
 
+    async def send_email(self, to_email: str, subject: str, body: str, attachments: list = None,
+                         smtp_account_id: Optional[int] = None):
+        """Standard email with optional attachments"""
         try:
-            await aiosmtplib.send(
-                message,
-                hostname=settings.smtp_server,
-                port=settings.smtp_port or 587,
-                start_tls=True,
-                username=settings.smtp_username,
-                password=settings.smtp_password,
-            )
+            await self.deliver_email(to_email, subject, body, attachments, smtp_account_id)
             return True
         except Exception as e:
             print(f"Failed to send email: {e}")
             return False
 
+    async def deliver_email(self, to_email: str, subject: str, body: str, attachments: list = None,
+                            smtp_account_id: Optional[int] = None, parts_sent: int = 0, on_part_sent=None):
+        """Like send_email, but errors propagate (used by the outbound spool to decide on retries)"""
+        await self._deliver(to_email, subject, body, None, attachments, smtp_account_id, parts_sent, on_part_sent)
+
+    async def _deliver(self, to_email: str, subject: str, text: str, html: Optional[str], attachments: list = None,
+                       smtp_account_id: Optional[int] = None, parts_sent: int = 0, on_part_sent=None):
+        """
+        Render the message to disk and send it. Attachments that would push it past
+        EMAIL_MAX_MESSAGE_MB go out in follow-up emails; any single file too big
+        for a message on its own is left out with a note in the body.
+        A retry passes the number of messages already sent (reported through
+        on_part_sent(number, total)) so they are not sent twice.
+        """
+        pool, sender = await self.route_for(smtp_account_id)
+
+        files = [media_store.resolve(ref) for ref in attachments or [] if ref and media_store.exists(ref)]
+        budget = EMAIL_MAX_MESSAGE_MB * 1024 * 1024
+        # Text parts may themselves end up base64-encoded
+        body_size = encoded_size(len(text.encode()) + (len(html.encode()) if html else 0))
+        batches, dropped = plan_batches(files, budget, body_size)
+        for filename, size in dropped:
+            note = f"[Attachment {filename} ({size / (1024 * 1024):.1f} MB) not sent: larger than the {EMAIL_MAX_MESSAGE_MB} MB email limit]"
+            text += f"\n\n{note}"
+            if html is not None:
+                html += f"<p><em>{escape(note)}</em></p>"
+        self.stats["dropped_attachments"] += len(dropped)
+
+        loop = asyncio.get_running_loop()
+        for number, batch in enumerate(batches, 1):
+            if number <= parts_sent:
+                continue
+            if number == 1:
+                part_subject, part_text, part_html = subject, text, html
+            else:
+                part_subject = f"{subject} (attachments {number}/{len(batches)})"
+                part_text, part_html = f"Attachments continued from \"{subject}\".", None
+                self.stats["follow_ups"] += 1
+            path = media_store.staging_path("outbound.eml")
+            try:
+                await loop.run_in_executor(
+                    None, write_message, path, sender, to_email,
+                    part_subject, part_text, part_html, batch
+                )
+                await pool.send_file(sender, [to_email], path)
+            finally:
+                if os.path.exists(path):
+                    os.remove(path)
+            if on_part_sent:
+                await on_part_sent(number, len(batches))
+        self.stats["sent"] += 1
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
 email_service = EmailService()
 send_email = email_service.send_email
 send_html_digest = email_service.send_html_digest
@@ -0,0 +1,199 @@
+"""
+Email Spool - Durable outbound queue for instant email forwards
+
+Forwarding code enqueues a row in outbound_emails and returns immediately. The
+row is written by log_writer in the same batch as its MessageLog, and the
+workers are woken once that batch is committed. They deliver due rows through email_service, retrying transient
+failures with exponential backoff. Rows survive restarts: anything left in
+SENDING by a crash is re-queued on start(). An email split into follow-ups
+resumes after its last delivered part. Digests are not spooled, their
+PENDING MessageLog rows already retry on the next scheduler run.
+"""
+import asyncio
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+import aiosmtplib
+from database import AsyncSessionLocal, OutboundEmail, MessageLog
+from sqlalchemy import select, update
+from services.email_service import email_service
+from services.log_writer import log_writer
+
+EMAIL_SPOOL_WORKERS = int(os.getenv("EMAIL_SPOOL_WORKERS", 2))
+# Give up (status DEAD, MessageLog FAILED) after this many delivery attempts
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 8))
+EMAIL_RETRY_BASE_DELAY = int(os.getenv("EMAIL_RETRY_BASE_DELAY", 30))
+EMAIL_RETRY_MAX_DELAY = int(os.getenv("EMAIL_RETRY_MAX_DELAY", 3600))
+# Concurrent deliveries per SMTP server, whatever the number of workers
+EMAIL_SERVER_CONCURRENCY = int(os.getenv("EMAIL_SERVER_CONCURRENCY", 2))
+# How often idle workers look for rows whose retry time has come
+EMAIL_SPOOL_POLL = int(os.getenv("EMAIL_SPOOL_POLL", 5))
+
+def _is_permanent(error: Exception) -> bool:
+    """5xx replies (bad recipient, rejected content) won't succeed on retry"""
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, aiosmtplib.SMTPResponseException) and 500 <= error.code < 600
+
+def _retry_delay(attempts: int) -> float:
+    return min(EMAIL_RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), EMAIL_RETRY_MAX_DELAY)
+
+
+class EmailSpool:
+    def __init__(self):
+        self._workers: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._claim_lock = asyncio.Lock()
+        self._claimed: Set[int] = set()
+        self._server_slots: Dict[str, asyncio.Semaphore] = {}
+        self.running = False
+        self.stats = {"enqueued": 0, "sent": 0, "retried": 0, "dead": 0, "requeued_on_start": 0}
+
+    def enqueue(self, to_email: str, subject: str, body: str, attachments: list = None,
+                log: Optional[MessageLog] = None, smtp_account_id: Optional[int] = None) -> OutboundEmail:
+        """
+        Queue an outbound email; its MessageLog (if any) stays QUEUED until delivery settles.
+        Durable once log_writer's next batch commits (the same batch as the log row).
+        """
+        if log is not None:
+            log_writer.set_status(log, "QUEUED")
+        row = log_writer.add_outbound(OutboundEmail(
+            smtp_account_id=smtp_account_id,
+            to_email=to_email,
+            subject=subject,
+            body=body,
+            attachments_json=json.dumps([a for a in attachments or [] if a]),
+            status="QUEUED",
+            attempts=0,
+            next_attempt_at=datetime.now(timezone.utc)
+        ), log)
+        self.stats["enqueued"] += 1
+        return row
+
+    async def _claim(self) -> Optional[OutboundEmail]:
+        """Mark the oldest due QUEUED row as SENDING and hand it to one worker"""
+        async with self._claim_lock:
+            async with AsyncSessionLocal() as db:
+                query = select(OutboundEmail).where(
+                    OutboundEmail.status == "QUEUED",
+                    OutboundEmail.next_attempt_at <= datetime.now(timezone.utc)
+                ).order_by(OutboundEmail.next_attempt_at, OutboundEmail.id).limit(1)
+                if self._claimed:
+                    query = query.where(OutboundEmail.id.notin_(self._claimed))
+                row = (await db.execute(query)).scalar_one_or_none()
+                if row is None:
+                    return None
+                row.status = "SENDING"
+                await db.commit()
+            self._claimed.add(row.id)
+            return row
+
+    async def _finish(self, row: OutboundEmail, status: str, log_status: Optional[str] = None,
+                      error: Optional[str] = None, next_attempt_at: Optional[datetime] = None):
+        async with AsyncSessionLocal() as db:
+            values = {"status": status, "attempts": row.attempts, "last_error": error}
+            if next_attempt_at is not None:
+                values["next_attempt_at"] = next_attempt_at
+            await db.execute(update(OutboundEmail).where(OutboundEmail.id == row.id).values(**values))
+            if log_status and row.message_log_id:
+                await db.execute(update(MessageLog).where(MessageLog.id == row.message_log_id).values(status=log_status))
+            await db.commit()
+
+    async def _part_sent(self, row: OutboundEmail, number: int, total: int):
+        """Remember the messages of a split email that went out, so a retry only sends the rest"""
+        if number == total:
+            return  # Done: the row is finished as SENT
+        row.parts_sent = number
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(OutboundEmail).where(OutboundEmail.id == row.id).values(parts_sent=number))
+            await db.commit()
+
+    async def _deliver(self, row: OutboundEmail):
+        attachments = json.loads(row.attachments_json) if row.attachments_json else []
+        row.attempts = (row.attempts or 0) + 1
+        try:
+            key = await email_service.server_key(row.smtp_account_id)
+            slots = self._server_slots.setdefault(key, asyncio.Semaphore(EMAIL_SERVER_CONCURRENCY))
+            async with slots:
+                await email_service.deliver_email(
+                    row.to_email, row.subject, row.body, attachments, row.smtp_account_id, row.parts_sent or 0,
+                    lambda number, total: self._part_sent(row, number, total)
+                )
+        except Exception as e:
+            if _is_permanent(e) or row.attempts >= EMAIL_MAX_ATTEMPTS:
+                print(f"EmailSpool: Giving up on email {row.id} to {row.to_email} after {row.attempts} attempt(s): {e}")
+                self.stats["dead"] += 1
+                await self._finish(row, "DEAD", "FAILED", error=str(e))
+            else:
+                delay = _retry_delay(row.attempts)
+                print(f"EmailSpool: Email {row.id} failed (attempt {row.attempts}), retrying in {int(delay)}s: {e}")
+                self.stats["retried"] += 1
+                await self._finish(row, "QUEUED", error=str(e),
+                                   next_attempt_at=datetime.now(timezone.utc) + timedelta(seconds=delay))
+            return
+        self.stats["sent"] += 1
+        await self._finish(row, "SENT", "SENT")
+
+    async def _worker(self):
+        while self.running:
+            try:
+                row = await self._claim()
+            except Exception as e:
+                print(f"EmailSpool: Failed to claim work: {e}")
+                row = None
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=EMAIL_SPOOL_POLL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._deliver(row)
+            except Exception as e:
+                print(f"EmailSpool: Unexpected error delivering email {row.id}: {e}")
+            finally:
+                self._claimed.discard(row.id)
+
+    async def start(self):
+        if self.running: return
+        async with AsyncSessionLocal() as db:
+            # Deliveries interrupted by a crash or shutdown: send them again
+            result = await db.execute(
+                update(OutboundEmail).where(OutboundEmail.status == "SENDING").values(status="QUEUED")
+            )
+            await db.commit()
+            self.stats["requeued_on_start"] = result.rowcount or 0
+        self.running = True
+        if self._wakeup.set not in log_writer.outbound_listeners:
+            log_writer.outbound_listeners.append(self._wakeup.set)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(EMAIL_SPOOL_WORKERS)]
+        print(f"EmailSpool started ({EMAIL_SPOOL_WORKERS} workers, {self.stats['requeued_on_start']} re-queued)")
+
+    async def stop(self):
+        """Let in-flight deliveries finish; anything still QUEUED is picked up on the next start"""
+        self.running = False
+        self._wakeup.set()
+        for task in self._workers:
+            try: await task
+            except asyncio.CancelledError: pass
+        self._workers = []
+        print("EmailSpool stopped")
+
+    async def referenced_attachments(self) -> Set[str]:
+        """Media store refs of emails not yet delivered (kept alive by the media store GC)"""
+        buffered = {ref for row in log_writer.buffered_outbound() for ref in json.loads(row.attachments_json or "[]")}
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(OutboundEmail.attachments_json).where(
+                    OutboundEmail.status.in_(["QUEUED", "SENDING"]),
+                    OutboundEmail.attachments_json.isnot(None)
+                )
+            )
+            return buffered | {ref for value in result.scalars().all() for ref in json.loads(value)}
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "workers": len(self._workers), "in_flight": len(self._claimed)}
+
+email_spool = EmailSpool()
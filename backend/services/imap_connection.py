@@ -0,0 +1,151 @@
+"""
+IMAP Connection - Persistent authenticated IMAP session per account
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Optional
+import aioimaplib
+
+logger = logging.getLogger("imap_service")
+
+# Reused sessions idle for longer than this are checked with NOOP before use
+IMAP_HEALTH_CHECK_AFTER = int(os.getenv("IMAP_HEALTH_CHECK_AFTER", 30))
+IMAP_COMMAND_TIMEOUT = int(os.getenv("IMAP_COMMAND_TIMEOUT", 30))
+# Reconnect backoff after a failed connect/login (seconds)
+IMAP_RECONNECT_BASE_DELAY = int(os.getenv("IMAP_RECONNECT_BASE_DELAY", 5))
+IMAP_RECONNECT_MAX_DELAY = int(os.getenv("IMAP_RECONNECT_MAX_DELAY", 300))
+
+def _select_code(lines, code: bytes) -> Optional[int]:
+    """Read a response code such as [UIDVALIDITY 3857529045] from SELECT output"""
+    pattern = re.compile(rb'\[' + code + rb' (\d+)\]')
+    for line in lines:
+        if isinstance(line, (bytes, bytearray)):
+            match = pattern.search(line)
+            if match:
+                return int(match.group(1))
+    return None
+
+class IMAPConnection:
+    """
+    Keeps one logged-in session with INBOX selected open across polls.
+    get() hands out the live session, health-checking it with NOOP when it sat
+    unused, and only reconnects when the session is gone; failed connects are
+    retried with exponential backoff so provider login limits are not hammered.
+    """
+    def __init__(self, account_id: int, credentials_json: Optional[str]):
+        self.account_id = account_id
+        self.credentials_json = credentials_json
+        self.client = None
+        # From the SELECT response of the current session
+        self.uidvalidity: Optional[int] = None
+        self.uidnext: Optional[int] = None
+        self._lock = asyncio.Lock()
+        self._last_used = 0.0
+        self._retry_at = 0.0
+        self._failures = 0
+        self.connects = 0
+        self.reuses = 0
+        self.health_checks = 0
+        self.dropped = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    async def get(self):
+        """Return a healthy session, or None if the credentials are incomplete"""
+        async with self._lock:
+            if self.client is not None and time.monotonic() - self._last_used >= IMAP_HEALTH_CHECK_AFTER:
+                self.health_checks += 1
+                try:
+                    response = await asyncio.wait_for(self.client.noop(), IMAP_COMMAND_TIMEOUT)
+                    if response.result != 'OK':
+                        raise ConnectionError(f"NOOP returned {response.result}")
+                except Exception as e:
+                    logger.info(f"IMAP account {self.account_id}: session lost ({e}), reconnecting")
+                    self.discard()
+
+            if self.client is not None:
+                self.reuses += 1
+            else:
+                wait = self._retry_at - time.monotonic()
+                if wait > 0:
+                    raise ConnectionError(f"reconnect backoff, next attempt in {round(wait)}s")
+                try:
+                    self.client = await self._open()
+                except Exception:
+                    self._failures += 1
+                    delay = min(IMAP_RECONNECT_BASE_DELAY * 2 ** (self._failures - 1), IMAP_RECONNECT_MAX_DELAY)
+                    self._retry_at = time.monotonic() + delay
+                    raise
+                if self.client is None:
+                    return None
+                self._failures = 0
+                self._retry_at = 0.0
+                self.connects += 1
+            self._last_used = time.monotonic()
+            return self.client
+
+    async def _open(self):
+        creds = json.loads(self.credentials_json) if self.credentials_json else {}
+        host = creds.get("host")
+        port = creds.get("port", 993)
+        user = creds.get("user")
+        password = creds.get("password")
+
+        if not host or not user or not password:
+            return None
+
+        client = aioimaplib.IMAP4_SSL(host=host, port=port, timeout=IMAP_COMMAND_TIMEOUT)
+        try:
+            await client.wait_hello_from_server()
+            response = await client.login(user, password)
+            if response.result != 'OK':
+                raise ConnectionError(f"login failed: {response.result}")
+            response = await client.select('INBOX')
+            if response.result != 'OK':
+                raise ConnectionError(f"select INBOX failed: {response.result}")
+            self.uidvalidity = _select_code(response.lines, b'UIDVALIDITY')
+            self.uidnext = _select_code(response.lines, b'UIDNEXT')
+        except BaseException:
+            self._close_quietly(client)
+            raise
+        return client
+
+    def touch(self):
+        """Mark the session as just used (e.g. after an IDLE round)"""
+        self._last_used = time.monotonic()
+
+    def discard(self):
+        """Drop a session in an unknown state (error, timeout, cancelled command)"""
+        if self.client is not None:
+            self.dropped += 1
+            self._close_quietly(self.client)
+            self.client = None
+
+    @staticmethod
+    def _close_quietly(client):
+        async def _logout():
+            try: await asyncio.wait_for(client.logout(), 5)
+            except Exception: pass
+        asyncio.create_task(_logout())
+
+    async def close(self):
+        client, self.client = self.client, None
+        if client is not None:
+            try: await asyncio.wait_for(client.logout(), 5)
+            except Exception: pass
+
+    def get_stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "reuses": self.reuses,
+            "health_checks": self.health_checks,
+            "dropped": self.dropped,
+            "reconnect_in_s": round(max(0.0, self._retry_at - time.monotonic())),
+        }
@@ -0,0 +1,190 @@
+"""
+IMAP Fetch - Parse FETCH responses and BODYSTRUCTURE so messages can be fetched part by part
+"""
+import re
+from email.header import decode_header, make_header
+from email.utils import collapse_rfc2231_value, decode_rfc2231
+from typing import Dict, List, Optional
+
+_LITERAL = re.compile(rb'\{(\d+)\}$')
+_FETCH_START = re.compile(rb'^\d+ FETCH ')
+
+class Literal(bytes):
+    """Marks a {n} literal so it is never mistaken for an atom"""
+
+
+def _tokenize(segments) -> List:
+    """Split text segments into '(' ')' atoms, quoted strings and NIL; literals pass through"""
+    tokens = []
+    for segment in segments:
+        if isinstance(segment, Literal):
+            tokens.append(segment)
+            continue
+        text = _LITERAL.sub(b'', segment)  # The literal itself follows as the next segment
+        i, n = 0, len(text)
+        while i < n:
+            c = text[i:i + 1]
+            if c in b' \r\n':
+                i += 1
+            elif c in b'()':
+                tokens.append(c.decode())
+                i += 1
+            elif c == b'"':
+                j, value = i + 1, bytearray()
+                while j < n and text[j:j + 1] != b'"':
+                    if text[j:j + 1] == b'\\':
+                        j += 1
+                    value += text[j:j + 1]
+                    j += 1
+                tokens.append(value.decode(errors='replace'))
+                i = j + 1
+            else:
+                # Atoms such as BODY[HEADER.FIELDS (FROM SUBJECT)] keep their bracketed section
+                j, depth = i, 0
+                while j < n:
+                    ch = text[j:j + 1]
+                    if ch == b'[':
+                        depth += 1
+                    elif ch == b']':
+                        depth -= 1
+                    elif depth == 0 and ch in b' ()':
+                        break
+                    j += 1
+                atom = text[i:j].decode(errors='replace')
+                tokens.append(None if atom.upper() == 'NIL' else atom)
+                i = j
+    return tokens
+
+
+def _parse_list(tokens: List, pos: int):
+    """Parse the list starting after '(' at pos; returns (items, next position)"""
+    items = []
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == '(':
+            item, pos = _parse_list(tokens, pos + 1)
+            items.append(item)
+        elif token == ')':
+            return items, pos + 1
+        else:
+            items.append(token)
+            pos += 1
+    return items, pos
+
+
+def parse_fetch_response(lines) -> List[Dict[str, object]]:
+    """
+    Turn aioimaplib FETCH output into one dict per message, keyed by upper-case
+    data item name (UID, RFC822.SIZE, BODYSTRUCTURE, BODY[...]). Literals arrive
+    as separate bytearray elements after the line announcing them.
+    """
+    responses, current = [], None
+    for line in lines[:-1]:  # The last line is the completion text
+        if isinstance(line, bytearray):
+            if current is not None:
+                current.append(Literal(line))
+        elif isinstance(line, bytes) and _FETCH_START.match(line):
+            current = [line.split(b' ', 2)[2]]
+            responses.append(current)
+        elif current is not None:
+            current.append(line)
+
+    messages = []
+    for segments in responses:
+        tokens = _tokenize(segments)
+        if not tokens or tokens[0] != '(':
+            continue
+        items, _ = _parse_list(tokens, 1)
+        data = {}
+        for key, value in zip(items[0::2], items[1::2]):
+            if isinstance(key, str):
+                data[key.upper()] = value
+        messages.append(data)
+    return messages
+
+
+def _text(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.decode(errors='replace') if isinstance(value, bytes) else str(value)
+
+
+def _params(value) -> Dict[str, str]:
+    """Body parameter list ("charset" "utf-8" "name" "a.pdf") as a dict, RFC 2231 values decoded"""
+    if not isinstance(value, list):
+        return {}
+    params = {}
+    for key, val in zip(value[0::2], value[1::2]):
+        key, val = (_text(key) or '').lower(), _text(val) or ''
+        if key.endswith('*'):
+            key = key.rstrip('*')
+            val = collapse_rfc2231_value(decode_rfc2231(val))
+        params[key] = val
+    return params
+
+
+def _decode_words(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+
+class BodyPart:
+    """One leaf of a BODYSTRUCTURE with the section number to fetch it by"""
+    def __init__(self, section: str, content_type: str, params: Dict[str, str], encoding: str,
+                 size: int, disposition: Optional[str], disposition_params: Dict[str, str]):
+        self.section = section
+        self.content_type = content_type
+        self.params = params
+        self.encoding = encoding
+        self.size = size
+        self.disposition = disposition
+        self.filename = _decode_words(disposition_params.get('filename') or params.get('name'))
+
+    @property
+    def charset(self) -> str:
+        return self.params.get('charset') or 'utf-8'
+
+    @property
+    def is_attachment_disposition(self) -> bool:
+        return (self.disposition or '').lower() == 'attachment'
+
+
+def parse_bodystructure(structure, section: str = '') -> List[BodyPart]:
+    """Flatten a parsed BODYSTRUCTURE into its leaf parts (message/rfc822 parts are kept whole)"""
+    if not isinstance(structure, list) or not structure:
+        raise ValueError("invalid BODYSTRUCTURE")
+    if isinstance(structure[0], list):
+        # Multipart: the child lists come first, then the subtype and extension data
+        parts = []
+        for i, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            parts.extend(parse_bodystructure(child, f"{section}.{i + 1}" if section else str(i + 1)))
+        return parts
+
+    maintype, subtype = (_text(structure[0]) or 'text').lower(), (_text(structure[1]) or 'plain').lower()
+    content_type = f"{maintype}/{subtype}"
+    if content_type == 'message/rfc822':
+        disposition_index = 11
+    elif maintype == 'text':
+        disposition_index = 9
+    else:
+        disposition_index = 8
+    disposition, disposition_params = None, {}
+    if len(structure) > disposition_index and isinstance(structure[disposition_index], list):
+        disposition_field = structure[disposition_index]
+        disposition = _text(disposition_field[0]) if disposition_field else None
+        disposition_params = _params(disposition_field[1]) if len(disposition_field) > 1 else {}
+    try:
+        size = int(structure[6])
+    except (TypeError, ValueError, IndexError):
+        size = 0
+    return [BodyPart(
+        section or '1', content_type, _params(structure[2]),
+        (_text(structure[5]) or '7bit').lower(), size, disposition, disposition_params
+    )]
+
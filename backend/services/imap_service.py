@@ -6,20 +6,94 @@ import aioimaplib
 import email
 from email.header import decode_header
 import asyncio
+import json
 import logging
 import re
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 import os
-from database import AsyncSessionLocal, Account, AccountType, ForwardingRule, AppSettings
+from typing import Dict, List, Optional
+from database import AsyncSessionLocal, Account, AccountType, AppSettings, ImapSyncState
 from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from services.telegram_client import TelegramService
+from services.log_writer import log_writer
+from services.send_scheduler import send_scheduler, on_settled
+from services.imap_connection import IMAPConnection
+from services.imap_fetch import parse_fetch_response, parse_bodystructure
+from services.mime_parser import mime_parser
+from services.media_store import media_store, MediaStoreFull
+from services.rule_index import rule_index, WILDCARD
 
 logger = logging.getLogger("imap_service")
 
+# Polling tuning: each account starts at IMAP_POLL_INTERVAL and adapts within the min/max bounds
+IMAP_POLL_INTERVAL = int(os.getenv("IMAP_POLL_INTERVAL", 60))
+IMAP_MIN_POLL_INTERVAL = int(os.getenv("IMAP_MIN_POLL_INTERVAL", 15))
+IMAP_MAX_POLL_INTERVAL = int(os.getenv("IMAP_MAX_POLL_INTERVAL", 600))
+IMAP_MAX_CONCURRENCY = int(os.getenv("IMAP_MAX_CONCURRENCY", 10))
+IMAP_POLL_TIMEOUT = int(os.getenv("IMAP_POLL_TIMEOUT", 120))
+IMAP_MAX_BACKOFF = int(os.getenv("IMAP_MAX_BACKOFF", 1800))
+# Re-issue IDLE well before the 29 minute limit of RFC 2177
+IMAP_IDLE_TIMEOUT = int(os.getenv("IMAP_IDLE_TIMEOUT", 25 * 60))
+
+# Structure-first fetching: summaries per batch of UIDs, then only the parts rules need
+IMAP_FETCH_BATCH = int(os.getenv("IMAP_FETCH_BATCH", 50))
+IMAP_MAX_PART_MB = int(os.getenv("IMAP_MAX_PART_MB", 20))
+# Cap on the parts fetched for one message in total (parts are fetched and released one at a time)
+IMAP_MAX_MESSAGE_MB = int(os.getenv("IMAP_MAX_MESSAGE_MB", 50))
+# Above this many distinct rule senders the SEARCH gets unwieldy: filter client side instead
+IMAP_PUSHDOWN_MAX_SENDERS = int(os.getenv("IMAP_PUSHDOWN_MAX_SENDERS", 50))
+SUMMARY_ITEMS = '(UID RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (FROM SUBJECT)])'
+
+def _clamp_interval(interval: float) -> float:
+    return round(min(max(interval, IMAP_MIN_POLL_INTERVAL), IMAP_MAX_POLL_INTERVAL), 1)
+
+def _parse_uids(lines) -> List[int]:
+    """UIDs from a UID SEARCH response (the last line is the completion text)"""
+    uids = []
+    for line in lines[:-1]:
+        if isinstance(line, (bytes, bytearray)):
+            uids.extend(int(token) for token in line.split() if token.isdigit())
+    return uids
+
+def _literal(lines) -> Optional[bytes]:
+    """The message literal of a single-message FETCH response"""
+    for line in lines:
+        if isinstance(line, bytearray):
+            return bytes(line)
+    return None
+
+def _sender_criteria(rules) -> Optional[str]:
+    """IMAP SEARCH criteria matching any rule sender: OR OR FROM "a" FROM "b" FROM "c"; None if not expressible"""
+    senders = sorted({key for rule in rules for key in rule.keys})
+    if WILDCARD in senders or len(senders) > IMAP_PUSHDOWN_MAX_SENDERS:
+        return None
+    if any(not sender.isascii() or '\r' in sender or '\n' in sender for sender in senders):
+        return None  # Would need CHARSET/literals
+    terms = ['FROM "{}"'.format(sender.replace('\\', '\\\\').replace('"', '\\"')) for sender in senders]
+    return 'OR ' * (len(terms) - 1) + ' '.join(terms)
+
 class IMAPService:
+    """
+    One supervised task per active IMAP account. The supervisor (poll_loop)
+    reconciles the task set with the DB every IMAP_POLL_INTERVAL seconds; each
+    account task polls on its own adaptive interval, bounded by a global
+    concurrency cap and a per-poll timeout, and backs off independently on failure.
+    Sessions stay logged in between polls (see IMAPConnection). Servers
+    advertising IDLE are pushed to instead of polled (disable with "idle": false
+    in the account credentials).
+    """
     def __init__(self):
         self.running = False
         self._task = None
+        self._account_tasks: Dict[int, asyncio.Task] = {}
+        self._accounts: Dict[int, Account] = {}
+        self._slots = asyncio.Semaphore(IMAP_MAX_CONCURRENCY)
+        self.account_status: Dict[int, dict] = {}
+        self._idle_unsupported = set()
+        self._connections: Dict[int, IMAPConnection] = {}
+        self._sync_state: Dict[int, Optional[dict]] = {}
 
     async def start(self):
         if self.running: return
@@ -29,206 +103,461 @@ class IMAPService:
 
     async def stop(self):
         self.running = False
-        if self._task:
-            self._task.cancel()
-            try: await self._task
+        tasks = [t for t in [self._task, *self._account_tasks.values()] if t]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try: await task
             except asyncio.CancelledError: pass
+        self._account_tasks.clear()
+        for connection in self._connections.values():
+            await connection.close()
+        self._connections.clear()
         logger.info("IMAP Service stopped")
             
     async def poll_loop(self):
+        """Supervisor: keep exactly one running task per active IMAP account"""
         while self.running:
             try:
-                print(f"💓 [HEARTBEAT] {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - IMAP check started")
+                print(f"💓 [HEARTBEAT] {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - IMAP supervisor check ({len(self._account_tasks)} accounts)")
                 async with AsyncSessionLocal() as db:
                     result = await db.execute(select(Account).where(Account.account_type == AccountType.EMAIL_IMAP, Account.is_active == True))
-                    accounts = result.scalars().all()
-                    
-                    if not accounts:
-                        await asyncio.sleep(60)
-                        continue
-
-                    for account in accounts:
-                        await self.poll_account(account)
+                    accounts = {acc.id: acc for acc in result.scalars().all()}
+
+                # Account loops always read the latest row (credentials may have changed)
+                self._accounts = accounts
+                for account_id in list(self._account_tasks):
+                    if account_id not in accounts:
+                        self._account_tasks.pop(account_id).cancel()
+                        self.account_status.pop(account_id, None)
+                        connection = self._connections.pop(account_id, None)
+                        if connection: connection.discard()
+                for account_id in accounts:
+                    task = self._account_tasks.get(account_id)
+                    if task is None or task.done():
+                        self._account_tasks[account_id] = asyncio.create_task(self._account_loop(account_id))
             except Exception as e:
-                logger.error(f"Error in IMAP poll loop: {e}")
-            await asyncio.sleep(60)
+                logger.error(f"Error in IMAP supervisor loop: {e}")
+            await asyncio.sleep(IMAP_POLL_INTERVAL)
 
-    async def poll_account(self, account: Account):
-        """Poll a specific IMAP account and route messages based on rules"""
-        import json
+    async def _account_loop(self, account_id: int):
+        status = self.account_status.setdefault(account_id, {
+            "mode": "poll", "interval_s": _clamp_interval(IMAP_POLL_INTERVAL), "last_poll_at": None,
+            "last_latency_ms": None, "last_error": None, "consecutive_failures": 0, "polls": 0,
+            "last_arrivals": 0, "next_poll_at": None,
+        })
+        while self.running and account_id in self._accounts:
+            account = self._accounts[account_id]
+            started = time.monotonic()
+            try:
+                if account_id not in self._idle_unsupported and self.get_credentials(account).get("idle", True):
+                    if await self.idle_session(account, status):
+                        continue  # Credentials changed or service stopping: reconnect
+                    self._idle_unsupported.add(account_id)
+                    status["mode"] = "poll"
+                    logger.info(f"IMAP account {account_id}: server has no IDLE support, falling back to polling")
+                async with self._slots:
+                    started = time.monotonic()
+                    arrivals = await asyncio.wait_for(self.poll_account(account), IMAP_POLL_TIMEOUT)
+                status["last_arrivals"] = arrivals
+                status["interval_s"] = delay = self._next_interval(status["interval_s"], arrivals)
+                self._record_success(status, started, delay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = f"timed out after {IMAP_POLL_TIMEOUT}s" if isinstance(e, asyncio.TimeoutError) else str(e)
+                logger.error(f"IMAP poll failed for account {account_id}: {error}")
+                status["last_error"] = error
+                status["consecutive_failures"] += 1
+                delay = min(status["interval_s"] * 2 ** status["consecutive_failures"], IMAP_MAX_BACKOFF)
+                self._record_poll(status, started, delay)
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _next_interval(interval: float, arrivals: int) -> float:
+        """Halve the interval while mail keeps arriving, stretch it by half while the mailbox is quiet"""
+        return _clamp_interval(interval / 2 if arrivals else interval * 1.5)
+
+    def _record_success(self, status: dict, started: float, delay):
+        status["last_error"] = None
+        status["consecutive_failures"] = 0
+        self._record_poll(status, started, delay)
+
+    def _record_poll(self, status: dict, started: float, delay):
+        status["polls"] += 1
+        status["last_poll_at"] = datetime.now().isoformat()
+        status["last_latency_ms"] = round((time.monotonic() - started) * 1000)
+        status["next_poll_at"] = datetime.fromtimestamp(time.time() + delay).isoformat() if delay is not None else None
+
+    def get_status(self) -> dict:
+        return {
+            str(account_id): {
+                "name": self._accounts[account_id].name if account_id in self._accounts else None,
+                **status,
+                "connection": self._connections[account_id].get_stats() if account_id in self._connections else None,
+            }
+            for account_id, status in self.account_status.items()
+        }
+
+    def _same_account(self, account: Account) -> bool:
+        """False once the account was removed or its credentials edited (the session must be rebuilt)"""
+        current = self._accounts.get(account.id)
+        return current is not None and current.credentials_json == account.credentials_json
+
+    @staticmethod
+    def get_credentials(account: Account) -> dict:
+        return json.loads(account.credentials_json) if account.credentials_json else {}
+
+    def _connection_for(self, account: Account) -> IMAPConnection:
+        """The account's persistent session; replaced when its credentials change"""
+        connection = self._connections.get(account.id)
+        if connection is None or connection.credentials_json != account.credentials_json:
+            if connection is not None:
+                connection.discard()
+            connection = self._connections[account.id] = IMAPConnection(account.id, account.credentials_json)
+        return connection
+
+    async def poll_account(self, account: Account) -> int:
+        """Poll a specific IMAP account and route messages based on rules; returns the number of new messages"""
+        connection = self._connection_for(account)
+        imap_client = await connection.get()
+        if not imap_client:
+            return 0
         try:
-            creds = json.loads(account.credentials_json) if account.credentials_json else {}
-            host = creds.get("host")
-            port = creds.get("port", 993)
-            user = creds.get("user")
-            password = creds.get("password")
-            
-            if not host or not user or not password:
-                return
+            return await self.process_new_messages(account, connection, imap_client)
+        except BaseException:
+            connection.discard()
+            raise
 
-            imap_client = aioimaplib.IMAP4_SSL(host=host, port=port)
-            await imap_client.wait_hello_from_server()
-            await imap_client.login(user, password)
-            await imap_client.select('INBOX')
-            
-            rv, data = await imap_client.search('UNSEEN')
-            if rv != 'OK':
-                await imap_client.logout()
-                return
-
-            msg_ids = data[0].split()
-            if not msg_ids:
-                await imap_client.logout()
-                return
-
-            print(f"📩 Account {account.name}: Found {len(msg_ids)} unread emails")
-
-            for msg_id in msg_ids:
-                rv, data = await imap_client.fetch(msg_id, '(RFC822)')
-                if rv != 'OK': continue
-
-                raw_email = data[1]
-                msg = email.message_from_bytes(raw_email)
-                subject = self.decode_mime_header(msg['Subject'])
-                sender = self.decode_mime_header(msg['From'])
-                
-                email_match = re.search(r'[\w\.-]+@[\w\.-]+', sender)
-                clean_sender_email = email_match.group(0).lower() if email_match else sender.lower()
-
-                body = ""
-                attachments = []
-                temp_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'temp')
-                os.makedirs(temp_dir, exist_ok=True)
-
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        content_type = part.get_content_type()
-                        content_disposition = str(part.get("Content-Disposition"))
-
-                        if content_type == "text/plain" and "attachment" not in content_disposition:
-                            try:
-                                body += part.get_payload(decode=True).decode(errors='ignore')
-                            except: pass
-                        elif "attachment" in content_disposition or content_type not in ["text/plain", "text/html"]:
-                            filename = part.get_filename()
-                            if filename:
-                                filepath = os.path.join(temp_dir, f"{datetime.now().timestamp()}_{filename}")
-                                try:
-                                    with open(filepath, "wb") as f:
-                                        f.write(part.get_payload(decode=True))
-                                    attachments.append(filepath)
-                                except Exception as e:
-                                    logger.error(f"Failed to save attachment {filename}: {e}")
-                else: 
-                     try:
-                        body = msg.get_payload(decode=True).decode(errors='ignore')
-                     except: pass
-
-                # Route based on rules for THIS account
-                async with AsyncSessionLocal() as session:
-                    rule_result = await session.execute(
-                        select(ForwardingRule).where(
-                            ForwardingRule.source_account_id == account.id,
-                            ForwardingRule.enabled == True
-                        )
-                    )
-                    rules = rule_result.scalars().all()
-                
+    async def process_new_messages(self, account: Account, connection: IMAPConnection, imap_client) -> int:
+        """
+        Fetch messages above the persisted UID watermark and route them. On the first
+        sync, or when UIDVALIDITY changed (UIDs were reassigned), unread mail is
+        processed once and the watermark restarts at the mailbox's current top. The
+        resync keeps its own cursor, so an interrupted one resumes where it stopped.
+        """
+        state = await self._get_sync_state(account.id)
+        uidvalidity = connection.uidvalidity or 0
+        if state is None or state["uidvalidity"] != uidvalidity:
+            if state is not None:
+                logger.warning(f"IMAP account {account.id}: UIDVALIDITY changed, resyncing from unread mail")
+            if connection.uidnext:
+                baseline = connection.uidnext - 1
+            else:
+                top = await imap_client.uid_search('ALL')
+                baseline = max(_parse_uids(top.lines), default=0)
+            state = {"uidvalidity": uidvalidity, "last_uid": baseline, "resync_uid": 0}
+            await self._save_sync_state(account.id, state)
+        resync = state["resync_uid"] is not None
+        cursor = "resync_uid" if resync else "last_uid"
+        start_uid = state[cursor]
+        if resync:
+            response = await imap_client.uid_search(f'UNSEEN UID {start_uid + 1}:*')
+        else:
+            response = await imap_client.uid_search(f'UID {start_uid + 1}:*')
+        if response.result != 'OK':
+            raise RuntimeError(f"UID SEARCH failed: {response.result}")
+
+        # "n:*" always matches the highest UID, even when it is below n
+        uids = sorted(uid for uid in _parse_uids(response.lines) if uid > start_uid)
+        if not uids:
+            if resync:
+                await self._save_sync_state(account.id, {**state, "resync_uid": None})
+            return 0
+
+        candidates = await self._candidate_uids(account, imap_client, uids)
+        print(f"📩 Account {account.name}: Found {len(uids)} new emails, {len(candidates)} from rule senders")
+        mark_seen = self.get_credentials(account).get("mark_seen", True)
+        try:
+            for start in range(0, len(candidates), IMAP_FETCH_BATCH):
+                batch = candidates[start:start + IMAP_FETCH_BATCH]
+                summaries = await self._fetch_summaries(imap_client, batch)
+                for uid in batch:
+                    await self._process_uid(account, imap_client, uid, summaries.get(uid), mark_seen)
+                    state[cursor] = uid
+                    if resync:
+                        # Read mail isn't found again by UNSEEN: every message routed must be remembered
+                        await self._save_sync_state(account.id, state)
+            state[cursor] = uids[-1]  # Non-candidates are done too
+        finally:
+            if state[cursor] > start_uid:
+                await self._save_sync_state(account.id, state)
+        if resync:
+            await self._save_sync_state(account.id, {
+                "uidvalidity": uidvalidity, "last_uid": max(state["last_uid"], uids[-1]), "resync_uid": None
+            })
+        return len(uids)
+
+    async def _candidate_uids(self, account: Account, imap_client, uids: List[int]) -> List[int]:
+        """
+        Narrow new UIDs to those whose sender a rule may match, by pushing the
+        rule senders down as an ORed FROM search. The server's FROM is a substring
+        match, so the header check in _process_uid still decides. Wildcard rules
+        (and filters a search can't express) keep every UID for client-side matching.
+        """
+        rules = await rule_index.get_account_rules(account.id)
+        if not rules:
+            return []
+        criteria = _sender_criteria(rules)
+        if criteria is None:
+            return uids
+        response = await imap_client.uid_search(f'UID {uids[0]}:{uids[-1]} {criteria}')
+        if response.result != 'OK':
+            return uids  # Server rejected the search: match client side
+        new = set(uids)
+        return sorted(uid for uid in _parse_uids(response.lines) if uid in new)
+
+    async def _get_sync_state(self, account_id: int) -> Optional[dict]:
+        if account_id not in self._sync_state:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(select(ImapSyncState).where(
+                    ImapSyncState.account_id == account_id, ImapSyncState.mailbox == "INBOX"
+                ))
+                row = result.scalar_one_or_none()
+            self._sync_state[account_id] = {
+                "uidvalidity": row.uidvalidity, "last_uid": row.last_uid, "resync_uid": row.resync_uid
+            } if row else None
+        return self._sync_state[account_id]
+
+    async def _save_sync_state(self, account_id: int, state: dict):
+        async with AsyncSessionLocal() as db:
+            stmt = sqlite_insert(ImapSyncState).values(
+                account_id=account_id, mailbox="INBOX", uidvalidity=state["uidvalidity"], last_uid=state["last_uid"],
+                resync_uid=state["resync_uid"]
+            )
+            await db.execute(stmt.on_conflict_do_update(
+                index_elements=["account_id", "mailbox"],
+                set_={"uidvalidity": stmt.excluded.uidvalidity, "last_uid": stmt.excluded.last_uid,
+                      "resync_uid": stmt.excluded.resync_uid, "updated_at": datetime.now(timezone.utc)}
+            ))
+            await db.commit()
+        self._sync_state[account_id] = dict(state)
+
+    async def _fetch_summaries(self, imap_client, uids: List[int]) -> Dict[int, dict]:
+        """Size, BODYSTRUCTURE and From/Subject of a batch of messages in one UID FETCH"""
+        response = await imap_client.uid('fetch', ','.join(str(uid) for uid in uids), SUMMARY_ITEMS)
+        if response.result != 'OK':
+            raise RuntimeError(f"UID FETCH of message summaries failed: {response.result}")
+        summaries = {}
+        for data in parse_fetch_response(response.lines):
+            try:
+                summaries[int(data.get('UID'))] = data
+            except (TypeError, ValueError):
+                continue
+        return summaries
+
+    async def _process_uid(self, account: Account, imap_client, uid: int, summary: Optional[dict], mark_seen: bool):
+        """Match rules on the headers; only matching messages get their content fetched"""
+        if summary is None:
+            return  # Expunged since the search
+        header = next((v for k, v in summary.items() if k.startswith('BODY[HEADER')), None)
+        headers = email.message_from_bytes(header if isinstance(header, bytes) else b'')
+        subject = self.decode_mime_header(headers['Subject'])
+        sender = self.decode_mime_header(headers['From'])
+
+        email_match = re.search(r'[\w\.-]+@[\w\.-]+', sender)
+        clean_sender_email = email_match.group(0).lower() if email_match else sender.lower()
+
+        rules = await rule_index.match(account.id, clean_sender_email)
+        if rules:
+            body, files = await self._fetch_content(imap_client, uid, summary)
+            body, attachments = await self._store_attachments(body, files)
+            try:
                 for rule in rules:
-                    filters = json.loads(rule.source_filter_json) if rule.source_filter_json else []
-                    # Filter by sender email
-                    # Filter by sender email
-                    if not filters or clean_sender_email in filters or "*" in filters:
-                        await self.process_imap_routing(rule, sender, subject, body, attachments)
-                
-                # Mark as seen so we don't process it again next time
-                await imap_client.store(msg_id, '+FLAGS', '(\\Seen)')
-                
-                # Cleanup attachments (if not used by digest? Wait, digest needs them persistent... 
-                # Actually for digest we should move them to media dir. For instant we delete.)
-                # Ideally process_imap_routing handles logic.
-
-            await imap_client.logout()
-        except Exception as e:
-            logger.error(f"IMAP poll failed for account {account.id}: {e}")
+                    await self.process_imap_routing(rule, sender, subject, body, attachments)
+            finally:
+                for ref in attachments:
+                    media_store.unpin(ref)
+
+        # The UID watermark prevents reprocessing; the flag is only for the user's mail client
+        if mark_seen:
+            await imap_client.uid('store', str(uid), '+FLAGS', '(\\Seen)')
+
+    async def _fetch_content(self, imap_client, uid: int, summary: dict):
+        """
+        Fetch the text and attachment parts a rule can forward, one part per UID FETCH so
+        only one part's raw bytes are in memory at a time. Parts over IMAP_MAX_PART_MB, and
+        parts that would take the message past IMAP_MAX_MESSAGE_MB, are replaced by a note.
+        """
+        structure = summary.get('BODYSTRUCTURE')
+        try:
+            parts = parse_bodystructure(structure)
+        except (ValueError, TypeError, IndexError):
+            return await self._fetch_full(imap_client, uid, summary)
+
+        multipart = isinstance(structure[0], list)
+        text_parts, attachment_parts = [], []
+        for part in parts:
+            if not multipart or (part.content_type == "text/plain" and not part.is_attachment_disposition):
+                text_parts.append(part)
+            elif (part.is_attachment_disposition or part.content_type not in ["text/plain", "text/html"]) and part.filename:
+                attachment_parts.append(part)
+
+        limit = IMAP_MAX_PART_MB * 1024 * 1024
+        budget = IMAP_MAX_MESSAGE_MB * 1024 * 1024
+        notes = []
+        body = ""
+        attachments = []
+        # Text first, so the body gets the message budget before attachments do
+        for part in text_parts + attachment_parts:
+            name = part.filename or "Message text"
+            if part.size > limit:
+                notes.append(f"[{name} not forwarded: {part.size / (1024 * 1024):.1f} MB exceeds the {IMAP_MAX_PART_MB} MB limit]")
+                continue
+            if part.size > budget:
+                notes.append(f"[{name} not forwarded: the message exceeds the {IMAP_MAX_MESSAGE_MB} MB limit]")
+                continue
+            budget -= part.size
+            response = await imap_client.uid('fetch', str(uid), f"(BODY.PEEK[{part.section}])")
+            if response.result != 'OK':
+                raise RuntimeError(f"UID FETCH of message {uid} part {part.section} failed: {response.result}")
+            raw = _literal(response.lines)
+            response = None  # Only the part's bytes stay alive, and only until the next fetch
+            if raw is None:
+                continue
+            if part in text_parts:
+                body += await mime_parser.decode_text(raw, part.encoding, part.charset)
+            else:
+                try:
+                    attachments.append((await mime_parser.save_attachment(raw, part.encoding, part.filename), part.filename))
+                except Exception as e:
+                    logger.error(f"Failed to save attachment {part.filename}: {e}")
+            raw = None
+        if notes:
+            body = "\n\n".join([body, *notes]) if body else "\n".join(notes)
+        return body, attachments
+
+    async def _store_attachments(self, body: str, files):
+        """Move decoded attachments into the media store; returns the body and pinned refs"""
+        refs = []
+        for path, filename in files:
+            try:
+                refs.append(await media_store.put(path, filename))
+            except MediaStoreFull as e:
+                body = f"{body}\n\n[{filename} not forwarded: {e}]"
+        return body, refs
+
+    async def _fetch_full(self, imap_client, uid: int, summary: dict):
+        """Fallback for an unparseable BODYSTRUCTURE: the whole message, if it is within the size limit"""
+        try:
+            size = int(summary.get('RFC822.SIZE') or 0)
+        except (TypeError, ValueError):
+            size = 0
+        if size > IMAP_MAX_PART_MB * 1024 * 1024:
+            return f"[Message not forwarded: {size / (1024 * 1024):.1f} MB exceeds the {IMAP_MAX_PART_MB} MB limit]", []
+        response = await imap_client.uid('fetch', str(uid), '(BODY.PEEK[])')
+        raw_email = _literal(response.lines) if response.result == 'OK' else None
+        if raw_email is None:
+            return "", []
+        return await mime_parser.parse_message(raw_email)
+
+    async def idle_session(self, account: Account, status: dict) -> bool:
+        """
+        Keep one connection open and react to EXISTS pushes. IDLE is re-issued every
+        IMAP_IDLE_TIMEOUT seconds, below the 29-minute server limit. Returns False
+        right away if the server has no IDLE capability; errors propagate.
+        """
+        connection = self._connection_for(account)
+        imap_client = await connection.get()
+        if not imap_client:
+            return False
+        try:
+            if not imap_client.has_capability('IDLE'):
+                return False
+            status["mode"] = "idle"
+            while self.running and self._same_account(account):
+                started = time.monotonic()
+                async with self._slots:
+                    await asyncio.wait_for(self.process_new_messages(account, connection, imap_client), IMAP_POLL_TIMEOUT)
+                self._record_success(status, started, None)
+
+                idle = await imap_client.idle_start(timeout=IMAP_IDLE_TIMEOUT)
+                try:
+                    while imap_client.has_pending_idle():
+                        push = await imap_client.wait_server_push()
+                        if push == aioimaplib.STOP_WAIT_SERVER_PUSH:
+                            break  # Refresh IDLE before the server drops it
+                        if any(b'EXISTS' in line for line in push if isinstance(line, (bytes, bytearray))):
+                            break
+                finally:
+                    imap_client.idle_done()
+                    await asyncio.wait_for(idle, IMAP_POLL_TIMEOUT)
+                connection.touch()
+            return True
+        except BaseException:
+            connection.discard()
+            raise
 
     async def process_imap_routing(self, rule, sender, subject, body, attachments=None):
         from database import MessageLog, Account, AccountType
-        from services.email_service import send_email
+        from services.email_spool import email_spool
         from services.account_manager import account_manager
         import json
-        import shutil
-
-        # Ensure media directory for persistent storage (Digests)
-        media_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'media')
-        os.makedirs(media_dir, exist_ok=True)
 
         async with AsyncSessionLocal() as db:
             dest_acc_res = await db.execute(select(Account).where(Account.id == rule.destination_account_id))
             dest_account = dest_acc_res.scalar_one_or_none()
-            if not dest_account: return
+        if not dest_account: return
 
-            dest_config = json.loads(rule.destination_config_json) if rule.destination_config_json else {}
+        dest_config = json.loads(rule.destination_config_json) if rule.destination_config_json else {}
+        
+        # For Digest: the row references the first attachment's blob (MessageLog only supports one path currently)
+        # Future improvement: Support multiple attachment paths in DB
+        stored_attachment_path = None
+        if rule.forwarding_type == "digest" and attachments:
+            stored_attachment_path = attachments[0]
+
+        # Write-behind: the row is committed with the next log_writer batch
+        log = log_writer.add(MessageLog(
+            rule_id=rule.id,
+            source_account_id=rule.source_account_id,
+            message_id=f"imap_{datetime.now().timestamp()}",
+            sender_name=sender,
+            message_content=body[:1000],
+            attachment_path=stored_attachment_path,
+            status="PENDING" if rule.forwarding_type == "digest" else "PROCESSING"
+        ))
+
+        if rule.forwarding_type == "instant":
+            text = f"📧 *New Email Received*\n\n*From:* {sender}\n*Subject:* {subject}\n\n{body[:1000]}"
             
-            # For Digest: Move first attachment to media dir (MessageLog only supports one path currently)
-            # Future improvement: Support multiple attachment paths in DB
-            stored_attachment_path = None
-            if rule.forwarding_type == "digest" and attachments:
-                try:
-                    src = attachments[0]
-                    filename = os.path.basename(src)
-                    dst = os.path.join(media_dir, filename)
-                    shutil.copy2(src, dst)
-                    stored_attachment_path = dst
-                except Exception as e:
-                    logger.error(f"Failed to store attachment for digest: {e}")
-
-            log = MessageLog(
-                rule_id=rule.id,
-                source_account_id=rule.source_account_id,
-                message_id=f"imap_{datetime.now().timestamp()}",
-                sender_name=sender,
-                message_content=body[:1000],
-                attachment_path=stored_attachment_path,
-                status="PENDING" if rule.forwarding_type == "digest" else "PROCESSING"
-            )
-            db.add(log)
-            await db.flush()
-
-            if rule.forwarding_type == "instant":
-                text = f"📧 *New Email Received*\n\n*From:* {sender}\n*Subject:* {subject}\n\n{body[:1000]}"
-                
-                if dest_account.account_type in [AccountType.EMAIL_SMTP, AccountType.EMAIL_IMAP]:
-                    target_email = dest_config.get("email")
-                    if target_email:
-                        success = await send_email(target_email, subject, body, attachments) # Pass list
-                        log.status = "SENT" if success else "FAILED"
-                
-                elif dest_account.account_type == AccountType.TELEGRAM:
-                    target_chat = dest_config.get("chat_id")
-                    if target_chat:
-                        dest_client = await account_manager.get_client(dest_account.id)
-                        if dest_client:
-                            try:
-                                # Send text first
-                                await dest_client.send_message(
-                                    int(target_chat) if target_chat.startswith("-") or target_chat.isdigit() else target_chat, 
-                                    text
-                                )
-                                # Send attachments
-                                if attachments:
-                                    for att_path in attachments:
-                                        await dest_client.send_file(
-                                             int(target_chat) if target_chat.startswith("-") or target_chat.isdigit() else target_chat,
-                                             att_path
-                                        )
-
-                                log.status = "SENT"
-                            except Exception as e:
-                                logger.error(f"Telegram forward error: {e}")
-                                log.status = "FAILED"
+            if dest_account.account_type in [AccountType.EMAIL_SMTP, AccountType.EMAIL_IMAP]:
+                target_email = dest_config.get("email")
+                if target_email:
+                    email_spool.enqueue(target_email, subject, body, attachments,
+                                        log=log, smtp_account_id=dest_account.id)
             
-            await db.commit()
+            elif dest_account.account_type == AccountType.TELEGRAM:
+                target_chat = dest_config.get("chat_id")
+                if target_chat:
+                    dest_client = await account_manager.get_client(dest_account.id)
+                    if dest_client:
+                        try:
+                            target = int(target_chat) if target_chat.startswith("-") or target_chat.isdigit() else target_chat
+                            # Upload first: once sent, the files no longer need to stay pinned
+                            uploads = []
+                            for ref in attachments or []:
+                                path, filename = media_store.resolve(ref)
+                                uploads.append(await dest_client.upload_file(path, file_name=filename))
+                        except Exception as e:
+                            logger.error(f"Telegram forward error: {e}")
+                            log_writer.set_status(log, "FAILED")
+                            return
+                        # Each send goes through the destination lane so flood waits pause instead of failing.
+                        # Not awaited: a paused lane must not hold the poll slot; the log settles when all are done
+                        sends = [send_scheduler.submit(dest_account.id, target, lambda: dest_client.send_message(target, text))]
+                        for upload in uploads:
+                            sends.append(send_scheduler.submit(
+                                dest_account.id, target,
+                                lambda upload=upload: dest_client.send_file(target, upload)
+                            ))
+                        on_settled(sends, lambda error: self._settle_log(log, error))
+
+    @staticmethod
+    def _settle_log(log, error: Optional[BaseException]):
+        if error:
+            logger.error(f"Telegram forward error: {error}")
+        log_writer.set_status(log, "FAILED" if error else "SENT")
 
     def decode_mime_header(self, header):
         if not header: return "No Subject"
@@ -0,0 +1,299 @@
+"""
+Ingest Queue - Decouples Telethon update handlers from forwarding work
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, Optional, List
+
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'spool')
+SPILL_PATH = os.path.join(SPOOL_DIR, 'ingest.jsonl')
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_SPILL = "spill"
+
+# Tags spilled envelopes, so the ones left over by a previous process can be told apart
+RUN_ID = uuid.uuid4().hex
+
+class Envelope:
+    """
+    Lightweight reference to an incoming message waiting for a worker. An album
+    (messages sharing a grouped_id) travels as one envelope so a single worker
+    handles all of its messages together.
+    """
+    __slots__ = ("account_id", "chat_id", "message_id", "message", "rules", "enqueued_at", "album", "album_ids", "run")
+
+    def __init__(self, account_id: int, chat_id: str, message_id: int, message=None, rules: Optional[List] = None,
+                 enqueued_at: Optional[float] = None, album: Optional[List] = None, album_ids: Optional[List[int]] = None,
+                 run: str = RUN_ID):
+        self.account_id = account_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.message = message
+        self.rules = rules
+        self.enqueued_at = enqueued_at or time.time()
+        self.album = album
+        self.album_ids = [m.id for m in album] if album else album_ids
+        self.run = run
+
+    @property
+    def restored(self) -> bool:
+        """Spilled by a previous process: not in flight anywhere, and catch-up may replay it too"""
+        return self.run != RUN_ID
+
+    @property
+    def ids(self) -> List[int]:
+        return self.album_ids or [self.message_id]
+
+    def to_json(self) -> str:
+        # Only the identifiers survive a spill; message and rules are re-resolved by the worker
+        data = {
+            "account_id": self.account_id,
+            "chat_id": self.chat_id,
+            "message_id": self.message_id,
+            "enqueued_at": self.enqueued_at,
+            "run": self.run,
+        }
+        if self.album_ids:
+            data["album_ids"] = self.album_ids
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, line: str) -> "Envelope":
+        data = json.loads(line)
+        return cls(data["account_id"], data["chat_id"], data["message_id"], enqueued_at=data.get("enqueued_at"),
+                   album_ids=data.get("album_ids"), run=data.get("run", ""))
+
+
+class IngestQueue:
+    """
+    Bounded queue between the Telegram update handlers and a pool of forwarding workers.
+
+    When the queue is full the configured policy applies:
+      - block:       the handler waits for a free slot (backpressure onto Telethon)
+      - drop_oldest: the oldest queued message is discarded
+      - spill:       the message is appended to a JSONL spool on disk and re-fetched later
+    """
+    def __init__(self):
+        self.maxsize = int(os.getenv("INGEST_QUEUE_SIZE", 1000))
+        self.workers = int(os.getenv("INGEST_WORKERS", 4))
+        self.policy = os.getenv("INGEST_QUEUE_POLICY", POLICY_BLOCK).lower()
+        if self.policy not in (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_SPILL):
+            print(f"IngestQueue: Unknown policy '{self.policy}', falling back to '{POLICY_BLOCK}'")
+            self.policy = POLICY_BLOCK
+        self.queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._spill_lock = asyncio.Lock()
+        # Spilled envelopes name their account: hold them back until the accounts are registered
+        self._spill_released = asyncio.Event()
+        self.spilled = 0
+        self.running = False
+        # Metrics
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    async def start(self):
+        if self.running: return
+        self.running = True
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        if os.path.exists(SPILL_PATH):
+            with open(SPILL_PATH, "r") as f:
+                self.spilled = sum(1 for line in f if line.strip())
+            if self.spilled:
+                print(f"IngestQueue: {self.spilled} spilled messages pending from previous run")
+        self._spill_released.clear()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"IngestQueue started ({self.workers} workers, size {self.maxsize}, policy {self.policy})")
+
+    def release_spill(self):
+        """Called once AccountManager.start_all() has registered the accounts: start replaying the spill"""
+        self._spill_released.set()
+
+    async def stop(self):
+        self.running = False
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try: await task
+            except asyncio.CancelledError: pass
+        self._tasks = []
+        # Don't lose what is still queued: persist identifiers for the next start
+        if self.queue and not self.queue.empty():
+            pending = []
+            while not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            await self._spill(pending)
+        print("IngestQueue stopped")
+
+    async def put(self, envelope: Envelope):
+        """Called from the Telethon handler; returns as soon as the envelope is accepted"""
+        if not self.queue:
+            raise RuntimeError("IngestQueue is not started")
+        self.enqueued += 1
+        if not self.running:
+            # Shutting down: persist for the next start instead of queueing for dead workers
+            await self._spill([envelope])
+            return
+        if self.policy == POLICY_BLOCK:
+            await self.queue.put(envelope)
+            return
+        if self.policy == POLICY_SPILL and (self.spilled or self.queue.full()):
+            # Keep FIFO order once anything is on disk
+            await self._spill([envelope])
+            return
+        if self.queue.full() and self.policy == POLICY_DROP_OLDEST:
+            try:
+                dropped = self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+                self._abandon(dropped)
+                print(f"IngestQueue: Dropped message {dropped.message_id} from {dropped.chat_id} (queue full)")
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(envelope)
+
+    @staticmethod
+    def _abandon(envelope: Envelope):
+        """A message that will never be handled must not hold back its chat's update state"""
+        from services.account_manager import account_manager
+        service = account_manager.telegram_services.get(envelope.account_id)
+        if service:
+            for message_id in envelope.ids:
+                service.mark_handled(envelope.chat_id, message_id)
+
+    async def _spill(self, envelopes: List[Envelope]):
+        async with self._spill_lock:
+            os.makedirs(SPOOL_DIR, exist_ok=True)
+            with open(SPILL_PATH, "a") as f:
+                for env in envelopes:
+                    f.write(env.to_json() + "\n")
+            self.spilled += len(envelopes)
+
+    def restored_ids(self, account_id: int) -> Dict[str, set]:
+        """Message ids per chat of the account's envelopes left over by the previous run and not picked up yet"""
+        envelopes = [env for env in list(self.queue._queue) if env.restored] if self.queue else []
+        if self.spilled and os.path.exists(SPILL_PATH):
+            with open(SPILL_PATH, "r") as f:
+                for line in f:
+                    try:
+                        env = Envelope.from_json(line)
+                    except (ValueError, KeyError):
+                        continue
+                    if env.restored:
+                        envelopes.append(env)
+        pending: Dict[str, set] = {}
+        for env in envelopes:
+            if env.account_id == account_id:
+                pending.setdefault(env.chat_id, set()).update(env.ids)
+        return pending
+
+    async def _refill(self):
+        """Move spilled envelopes back into the queue while there is room"""
+        async with self._spill_lock:
+            if not self.spilled or not os.path.exists(SPILL_PATH):
+                self.spilled = 0
+                return
+            with open(SPILL_PATH, "r") as f:
+                lines = [line for line in f if line.strip()]
+            room = self.maxsize - self.queue.qsize()
+            batch, rest = lines[:room], lines[room:]
+            for line in batch:
+                try:
+                    self.queue.put_nowait(Envelope.from_json(line))
+                except (ValueError, KeyError) as e:
+                    print(f"IngestQueue: Skipping corrupt spill entry: {e}")
+            if rest:
+                tmp_path = SPILL_PATH + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.writelines(rest)
+                os.replace(tmp_path, SPILL_PATH)
+            else:
+                os.remove(SPILL_PATH)
+            self.spilled = len(rest)
+
+    async def _worker(self, worker_id: int):
+        from services.account_manager import account_manager
+        while self.running:
+            if self.spilled and self._spill_released.is_set() and self.queue.qsize() < self.maxsize // 2:
+                await self._refill()
+            try:
+                envelope = await asyncio.wait_for(self.queue.get(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+
+            wait = time.time() - envelope.enqueued_at
+            self.last_wait = wait
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            try:
+                service = account_manager.telegram_services.get(envelope.account_id)
+                if not service and envelope.account_id in account_manager.starting:
+                    # Account is still connecting in the background: keep the message for later
+                    await self._spill([envelope])
+                    await asyncio.sleep(1)
+                    continue
+                if not service or not service.client:
+                    print(f"IngestQueue: Account {envelope.account_id} not running, skipping message {envelope.message_id}")
+                    continue
+                if envelope.restored:
+                    # Catch-up may have replayed some of these messages already
+                    ids = service.adopt(envelope.chat_id, envelope.ids)
+                    if not ids:
+                        continue
+                    if envelope.album_ids:
+                        envelope.album_ids = ids
+                if envelope.album_ids:
+                    messages = envelope.album
+                    if messages is None:
+                        fetched = await service.client.get_messages(int(envelope.chat_id), ids=envelope.album_ids)
+                        messages = [m for m in fetched if m is not None]
+                        found = {m.id for m in messages}
+                        for message_id in envelope.album_ids:
+                            if message_id not in found:
+                                service.mark_handled(envelope.chat_id, message_id)  # Deleted meanwhile
+                    if not messages:
+                        continue
+                    await service.handle_album(messages, envelope.rules)
+                else:
+                    message = envelope.message
+                    if message is None:
+                        message = await service.client.get_messages(int(envelope.chat_id), ids=envelope.message_id)
+                        if message is None:
+                            service.mark_handled(envelope.chat_id, envelope.message_id)  # Deleted meanwhile
+                            continue
+                    await service.handle_message(message, envelope.rules)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"IngestQueue worker {worker_id}: Failed to process message {envelope.message_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def get_stats(self) -> dict:
+        handled = self.processed + self.failed
+        return {
+            "policy": self.policy,
+            "workers": self.workers,
+            "capacity": self.maxsize,
+            "depth": self.queue.qsize() if self.queue else 0,
+            "spilled": self.spilled,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_wait_ms": round(self.last_wait * 1000, 1),
+            "avg_wait_ms": round(self.total_wait / handled * 1000, 1) if handled else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,156 @@
+"""
+Log Writer - Write-behind batching of MessageLog inserts and status updates
+
+Durability: rows are buffered in memory and committed in a single transaction
+once LOG_WRITER_BATCH_SIZE rows are pending or LOG_WRITER_FLUSH_MS has elapsed,
+whichever comes first. A clean shutdown (stop()) flushes everything; a crash
+can lose at most the rows buffered since the last flush. Forwarding itself
+does not depend on the log row being persisted.
+
+Outbound email spool rows ride in the same transaction as their MessageLog,
+so queueing an email costs no commit of its own.
+"""
+import asyncio
+import os
+import time
+from typing import Callable, List, Optional, Tuple
+from database import AsyncSessionLocal, MessageLog, OutboundEmail
+from sqlalchemy import update
+
+class LogWriter:
+    def __init__(self):
+        self.batch_size = int(os.getenv("LOG_WRITER_BATCH_SIZE", 100))
+        self.flush_interval = int(os.getenv("LOG_WRITER_FLUSH_MS", 500)) / 1000
+        self._pending: List[MessageLog] = []
+        self._pending_ids = set()
+        self._updates: List[Tuple[MessageLog, str]] = []
+        self._outbound: List[Tuple[OutboundEmail, Optional[MessageLog]]] = []
+        # Called after a flush that wrote outbound rows (the email spool wakes its workers)
+        self.outbound_listeners: List[Callable[[], None]] = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.running = False
+        # Metrics
+        self.flushes = 0
+        self.rows_written = 0
+        self.updates_written = 0
+        self.outbound_written = 0
+        self.last_flush_ms = 0.0
+        self.errors = 0
+
+    async def start(self):
+        if self.running: return
+        self.running = True
+        self._task = asyncio.create_task(self._flush_loop())
+        print(f"LogWriter started (batch {self.batch_size} rows / {int(self.flush_interval * 1000)} ms)")
+
+    async def stop(self):
+        self.running = False
+        if self._task:
+            self._wakeup.set()
+            try: await self._task
+            except asyncio.CancelledError: pass
+        await self.flush()
+        print("LogWriter stopped")
+
+    def add(self, log: MessageLog) -> MessageLog:
+        """Buffer a new MessageLog; the same object is later passed to set_status()"""
+        self._pending.append(log)
+        self._pending_ids.add(id(log))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return log
+
+    def add_outbound(self, row: OutboundEmail, log: Optional[MessageLog] = None) -> OutboundEmail:
+        """Buffer a spool row; message_log_id is filled in from log once that row has its id"""
+        self._outbound.append((row, log))
+        if len(self._outbound) >= self.batch_size:
+            self._wakeup.set()
+        return row
+
+    def buffered_outbound(self) -> List[OutboundEmail]:
+        return [row for row, _ in self._outbound]
+
+    def set_status(self, log: MessageLog, status: str):
+        """Change the status of a buffered or already written MessageLog"""
+        log.status = status
+        if id(log) not in self._pending_ids:
+            # Already handed to a flush: record an UPDATE for the next transaction
+            self._updates.append((log, status))
+            if len(self._updates) >= self.batch_size:
+                self._wakeup.set()
+
+    async def flush(self):
+        """Write all buffered inserts and updates in one transaction"""
+        async with self._flush_lock:
+            if not self._pending and not self._updates and not self._outbound:
+                return
+            inserts, self._pending = self._pending, []
+            self._pending_ids = set()
+            updates, self._updates = self._updates, []
+            outbound, self._outbound = self._outbound, []
+
+            started = time.perf_counter()
+            try:
+                async with AsyncSessionLocal() as db:
+                    db.add_all(inserts)
+                    await db.flush()
+                    # The logs were added before their spool rows, so they have ids by now
+                    for row, log in outbound:
+                        row.message_log_id = log.id if log is not None else None
+                    db.add_all([row for row, _ in outbound])
+                    for log, status in updates:
+                        if log.id is None:
+                            continue
+                        await db.execute(update(MessageLog).where(MessageLog.id == log.id).values(status=status))
+                    await db.commit()
+            except Exception as e:
+                # Keep the rows for the next attempt rather than dropping them
+                self.errors += 1
+                print(f"LogWriter: Flush failed, will retry: {e}")
+                for log in inserts:
+                    log.id = None
+                for row, _ in outbound:
+                    row.id = None
+                self._pending = inserts + self._pending
+                self._pending_ids = {id(log) for log in self._pending}
+                self._updates = updates + self._updates
+                self._outbound = outbound + self._outbound
+                return
+
+            self.flushes += 1
+            self.rows_written += len(inserts)
+            self.updates_written += len(updates)
+            self.outbound_written += len(outbound)
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 1)
+            if outbound:
+                for listener in self.outbound_listeners:
+                    listener()
+
+    async def _flush_loop(self):
+        while self.running:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"LogWriter: Unexpected flush error: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "buffered_rows": len(self._pending),
+            "buffered_updates": len(self._updates),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "updates_written": self.updates_written,
+            "buffered_outbound": len(self._outbound),
+            "outbound_written": self.outbound_written,
+            "last_flush_ms": self.last_flush_ms,
+            "errors": self.errors,
+        }
+
+log_writer = LogWriter()
@@ -0,0 +1,151 @@
+"""
+Media Handle - Download a Telegram message's media once and share it between rules
+"""
+import asyncio
+import os
+from typing import Optional
+from services.media_store import media_store, MediaStoreFull
+from services.settings_cache import settings_cache
+
+# Hard per-download byte budget and download streaming parameters. For videos the admin's
+# max_video_size_mb setting, when set, replaces this budget (whether larger or smaller)
+MEDIA_DOWNLOAD_BUDGET_MB = int(os.getenv("MEDIA_DOWNLOAD_BUDGET_MB", 50))
+MEDIA_DOWNLOAD_CHUNK_KB = int(os.getenv("MEDIA_DOWNLOAD_CHUNK_KB", 512))
+MEDIA_DOWNLOAD_CONCURRENCY = int(os.getenv("MEDIA_DOWNLOAD_CONCURRENCY", 3))
+
+_download_slots = asyncio.Semaphore(MEDIA_DOWNLOAD_CONCURRENCY)
+download_stats = {"downloads": 0, "bytes": 0, "skipped": 0, "aborted": 0, "active": 0}
+
+class DownloadBudgetExceeded(Exception):
+    pass
+
+def _mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+class MediaHandle:
+    """
+    Per-message, reference-counted handle on a downloaded media file.
+
+    Every rule that may need the file holds one reference. The download happens
+    lazily on the first get_ref() and at most once, into the media store. The
+    blob stays pinned until the last reference is released; after that only
+    PENDING digest rows that store the ref keep it from the store's GC.
+    """
+    def __init__(self, message, consumers: int = 0):
+        self.message = message
+        self.ref: Optional[str] = None
+        self.skip_reason: Optional[str] = None
+        # Set when the type and size limits rule the media out (skip_reason also covers failed downloads)
+        self.limit_reason: Optional[str] = None
+        self._checked = False
+        self._downloaded = False
+        self._lock = asyncio.Lock()
+        self._check_lock = asyncio.Lock()
+        self._refs = consumers
+        self._budget = MEDIA_DOWNLOAD_BUDGET_MB * 1024 * 1024
+
+    @property
+    def placeholder(self) -> str:
+        """Text to put in place of media that was not downloaded"""
+        return f"[{self.skip_reason}]" if self.skip_reason else ""
+
+    @property
+    def filename(self) -> Optional[str]:
+        return media_store.resolve(self.ref)[1] if self.ref else None
+
+    async def get_path(self) -> Optional[str]:
+        """File system path of the downloaded blob (named by hash: use filename for uploads)"""
+        ref = await self.get_ref()
+        return media_store.resolve(ref)[0] if ref else None
+
+    async def get_ref(self) -> Optional[str]:
+        """Media store ref of the download, for MessageLog.attachment_path and send_email"""
+        async with self._lock:
+            if not self._downloaded:
+                self._downloaded = True
+                if self.message.file is None:
+                    return None  # Web page previews, polls, locations...: nothing to download
+                try:
+                    if not await self.check():
+                        self.ref = await self._download()
+                except Exception as e:
+                    print(f"Failed to download media for message {self.message.id}: {e}")
+        return self.ref
+
+    async def check(self) -> Optional[str]:
+        """Apply the limits without downloading (copy mode re-sends by reference); returns the skip reason"""
+        async with self._check_lock:
+            if not self._checked and self.message.file is not None:
+                self._checked = True
+                self.limit_reason = await self._check_limits()
+                if self.limit_reason:
+                    self.skip_reason = self.limit_reason
+                    download_stats["skipped"] += 1
+                    print(f"Media of message {self.message.id} skipped: {self.limit_reason}")
+        return self.limit_reason
+
+    async def _check_limits(self) -> Optional[str]:
+        """Decide from the document metadata, before any byte is fetched, whether to download"""
+        file = self.message.file
+        settings = await settings_cache.get()
+
+        size = file.size or 0
+        is_video = bool(self.message.video or self.message.gif or self.message.video_note)
+        if is_video:
+            if settings and settings.forward_videos is False:
+                return "Video not forwarded: video forwarding is disabled"
+            if settings and settings.max_video_size_mb:
+                self._budget = settings.max_video_size_mb * 1024 * 1024
+            if size > self._budget:
+                return f"Video not forwarded: {_mb(size)} exceeds the {_mb(self._budget)} limit"
+            return None
+        if self.message.document and settings and settings.forward_files is False:
+            return "File not forwarded: file forwarding is disabled"
+        if size > self._budget:
+            return f"File not forwarded: {_mb(size)} exceeds the {_mb(self._budget)} limit"
+        return None
+
+    async def _download(self) -> Optional[str]:
+        """Stream the media in chunks to a staging file, aborting if it outgrows the byte budget, then store it"""
+        file = self.message.file
+        name = os.path.basename(file.name) if file.name else f"{self.message.chat_id}{file.ext or ''}"
+        part_path = media_store.staging_path(name) + ".part"
+        budget = self._budget
+        written = 0
+
+        async with _download_slots:
+            download_stats["active"] += 1
+            try:
+                with open(part_path, "wb") as f:
+                    async for chunk in self.message.client.iter_download(
+                        self.message.media, request_size=MEDIA_DOWNLOAD_CHUNK_KB * 1024, file_size=file.size
+                    ):
+                        written += len(chunk)
+                        if written > budget:
+                            raise DownloadBudgetExceeded(f"download exceeded the {_mb(budget)} limit")
+                        f.write(chunk)
+            except BaseException as e:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                if isinstance(e, DownloadBudgetExceeded):
+                    download_stats["aborted"] += 1
+                    self.skip_reason = f"File not forwarded: {e}"
+                    return None
+                raise
+            finally:
+                download_stats["active"] -= 1
+
+        download_stats["downloads"] += 1
+        download_stats["bytes"] += written
+        try:
+            return await media_store.put(part_path, name)
+        except MediaStoreFull as e:
+            download_stats["skipped"] += 1
+            self.skip_reason = f"File not forwarded: {e}"
+            return None
+
+    def release(self, count: int = 1):
+        self._refs -= count
+        if self._refs == 0 and self.ref:
+            media_store.unpin(self.ref)
+
@@ -0,0 +1,212 @@
+"""
+Media Store - Content-addressed attachment storage with reference-counted garbage collection
+"""
+import asyncio
+import hashlib
+import os
+import time
+from typing import Dict, Optional, Tuple
+from database import AsyncSessionLocal, MessageLog
+from sqlalchemy import select
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+BLOB_DIR = os.path.join(DATA_DIR, 'blobs')
+STAGING_DIR = os.path.join(DATA_DIR, 'temp')
+# Directories used before the store existed; swept by the GC like staging
+LEGACY_DIRS = [os.path.join(DATA_DIR, 'media')]
+
+MEDIA_STORE_QUOTA_MB = int(os.getenv("MEDIA_STORE_QUOTA_MB", 2048))
+MEDIA_STORE_GC_INTERVAL = int(os.getenv("MEDIA_STORE_GC_INTERVAL", 600))
+# Unreferenced files younger than this are left alone (a row referencing them may be in flight)
+MEDIA_STORE_GRACE_SECONDS = int(os.getenv("MEDIA_STORE_GRACE_SECONDS", 3600))
+
+# MessageLog.attachment_path value for stored media: "blob:<sha256>/<original file name>"
+REF_PREFIX = "blob:"
+
+class MediaStoreFull(Exception):
+    pass
+
+def _hash_file(path: str) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def _scan(directory: str):
+    """(path, size, mtime) of every file below directory"""
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+
+class MediaStore:
+    """
+    Every attachment (Telegram download, IMAP part) is stored once under its
+    SHA-256, however many rules, digests or channels use it. A blob stays alive
+    while it is pinned in memory (a message still being forwarded) or a PENDING
+    MessageLog row references it; the background GC deletes everything else and
+    put() refuses new blobs once MEDIA_STORE_QUOTA_MB is used.
+    """
+    def __init__(self):
+        self._pins: Dict[str, int] = {}
+        self._usage: Optional[int] = None
+        self._task = None
+        self._gc_lock = asyncio.Lock()
+        self.stats = {"puts": 0, "dedup_hits": 0, "rejected": 0, "gc_runs": 0, "gc_deleted": 0, "gc_freed_bytes": 0}
+
+    @staticmethod
+    def staging_path(name: str) -> str:
+        """A unique scratch path to write a file to before put()"""
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        return os.path.join(STAGING_DIR, f"{time.time()}_{os.path.basename(name)}")
+
+    @staticmethod
+    def blob_path(digest: str) -> str:
+        return os.path.join(BLOB_DIR, digest[:2], digest)
+
+    @staticmethod
+    def is_ref(value: Optional[str]) -> bool:
+        return bool(value) and value.startswith(REF_PREFIX)
+
+    def resolve(self, ref: str) -> Tuple[str, str]:
+        """(file system path, attachment file name) of a ref; plain paths from before the store pass through"""
+        if not self.is_ref(ref):
+            return ref, os.path.basename(ref)
+        digest, _, filename = ref[len(REF_PREFIX):].partition("/")
+        return self.blob_path(digest), filename or digest
+
+    def exists(self, ref: Optional[str]) -> bool:
+        return bool(ref) and os.path.exists(self.resolve(ref)[0])
+
+    async def _get_usage(self) -> int:
+        if self._usage is None:
+            loop = asyncio.get_running_loop()
+            self._usage = await loop.run_in_executor(None, lambda: sum(size for _, size, _ in _scan(BLOB_DIR)))
+        return self._usage
+
+    async def put(self, path: str, filename: Optional[str] = None) -> str:
+        """
+        Move a finished file into the store and return its pinned ref (unpin() when
+        done with it). Raises MediaStoreFull if a new blob would exceed the quota.
+        """
+        filename = os.path.basename(filename or path)
+        loop = asyncio.get_running_loop()
+        digest, size = await loop.run_in_executor(None, _hash_file, path)
+        ref = f"{REF_PREFIX}{digest}/{filename}"
+        blob = self.blob_path(digest)
+        self.stats["puts"] += 1
+        self.pin(ref)
+        try:
+            if os.path.exists(blob):
+                self.stats["dedup_hits"] += 1
+                os.remove(path)
+                os.utime(blob)  # Restart the grace period
+                return ref
+
+            quota = MEDIA_STORE_QUOTA_MB * 1024 * 1024
+            if await self._get_usage() + size > quota:
+                await self.gc()
+                if await self._get_usage() + size > quota:
+                    self.stats["rejected"] += 1
+                    os.remove(path)
+                    raise MediaStoreFull(f"media store quota of {MEDIA_STORE_QUOTA_MB} MB reached")
+
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(path, blob)
+            self._usage += size
+            return ref
+        except BaseException:
+            self.unpin(ref)
+            raise
+
+    def pin(self, ref: Optional[str]):
+        """Keep a blob alive while a message using it is in flight"""
+        if self.is_ref(ref):
+            blob = self.resolve(ref)[0]
+            self._pins[blob] = self._pins.get(blob, 0) + 1
+
+    def unpin(self, ref: Optional[str]):
+        if self.is_ref(ref):
+            blob = self.resolve(ref)[0]
+            count = self._pins.get(blob, 0) - 1
+            if count > 0:
+                self._pins[blob] = count
+            else:
+                self._pins.pop(blob, None)
+
+    async def gc(self):
+        """Delete blobs (and staging/legacy files) nothing references any more"""
+        from services.log_writer import log_writer
+        from services.email_spool import email_spool
+        async with self._gc_lock:
+            # Rows still buffered by the write-behind writer must be visible
+            await log_writer.flush()
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(MessageLog.attachment_path).where(
+                        MessageLog.status == "PENDING",
+                        MessageLog.attachment_path.isnot(None)
+                    )
+                )
+                referenced = {os.path.abspath(self.resolve(value)[0]) for value in result.scalars().all()}
+            # Attachments of emails still waiting in the outbound spool
+            referenced |= {os.path.abspath(self.resolve(ref)[0]) for ref in await email_spool.referenced_attachments()}
+            keep = referenced | set(self._pins)
+
+            loop = asyncio.get_running_loop()
+            files = await loop.run_in_executor(
+                None, lambda: [entry for d in [BLOB_DIR, STAGING_DIR, *LEGACY_DIRS] for entry in _scan(d)]
+            )
+            cutoff = time.time() - MEDIA_STORE_GRACE_SECONDS
+            usage = 0
+            for path, size, mtime in files:
+                in_store = path.startswith(BLOB_DIR)
+                if os.path.abspath(path) in keep or mtime > cutoff:
+                    usage += size if in_store else 0
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    usage += size if in_store else 0
+                    continue
+                self.stats["gc_deleted"] += 1
+                self.stats["gc_freed_bytes"] += size
+            self._usage = usage
+            self.stats["gc_runs"] += 1
+
+    async def _gc_loop(self):
+        while True:
+            await asyncio.sleep(MEDIA_STORE_GC_INTERVAL)
+            try:
+                await self.gc()
+            except Exception as e:
+                print(f"MediaStore: GC failed: {e}")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._gc_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "used_mb": round((self._usage or 0) / (1024 * 1024), 1),
+            "quota_mb": MEDIA_STORE_QUOTA_MB,
+            "pinned": len(self._pins),
+        }
+
+media_store = MediaStore()
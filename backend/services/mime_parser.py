@@ -0,0 +1,154 @@
+"""
+MIME Parser - Decode e-mail parts in a worker thread pool, spooling attachments to disk
+"""
+import asyncio
+import base64
+import io
+import os
+import quopri
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesFeedParser
+from typing import List, Optional, Tuple
+from services.media_store import media_store
+
+MIME_PARSE_WORKERS = int(os.getenv("MIME_PARSE_WORKERS", 2))
+# Bytes of encoded input handled per step; bounds the extra memory a decode needs
+MIME_CHUNK_KB = int(os.getenv("MIME_CHUNK_KB", 256))
+
+_B64_JUNK = re.compile(rb'[^A-Za-z0-9+/]')
+
+def _chunk_size() -> int:
+    return max(4, MIME_CHUNK_KB * 1024)
+
+def _write_decoded(raw: bytes, encoding: str, out):
+    """Decode a Content-Transfer-Encoding into out one chunk at a time"""
+    chunk = _chunk_size()
+    if encoding == 'base64':
+        carry = b''
+        for start in range(0, len(raw), chunk):
+            data = carry + _B64_JUNK.sub(b'', raw[start:start + chunk])
+            usable = len(data) - len(data) % 4
+            out.write(base64.b64decode(data[:usable]))
+            carry = data[usable:]
+        if len(carry) > 1:  # A single leftover character carries no complete byte
+            out.write(base64.b64decode(carry + b'=' * (-len(carry) % 4)))
+    elif encoding == 'quoted-printable':
+        quopri.decode(io.BytesIO(raw), out)  # Line by line
+    else:
+        for start in range(0, len(raw), chunk):
+            out.write(raw[start:start + chunk])
+
+def _save(raw: bytes, encoding: str, filename: str) -> str:
+    path = media_store.staging_path(filename)
+    try:
+        with open(path, "wb") as f:
+            _write_decoded(raw, encoding, f)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return path
+
+def _decode_text(raw: bytes, encoding: str, charset: str) -> str:
+    out = io.BytesIO()
+    _write_decoded(raw, encoding, out)
+    try:
+        return out.getvalue().decode(charset, errors='ignore')
+    except LookupError:
+        return out.getvalue().decode('utf-8', errors='ignore')
+
+def _parse_message(raw: bytes) -> Tuple[str, List[Tuple[str, str]]]:
+    """Whole message (fallback path, size-capped by the caller); attachments are decoded straight to files"""
+    parser = BytesFeedParser()
+    parser.feed(raw)
+    msg = parser.close()
+
+    body = ""
+    attachments = []
+    if msg.is_multipart():
+        for part in msg.walk():
+            content_type = part.get_content_type()
+            content_disposition = str(part.get("Content-Disposition"))
+
+            if content_type == "text/plain" and "attachment" not in content_disposition:
+                try:
+                    body += part.get_payload(decode=True).decode(errors='ignore')
+                except: pass
+            elif "attachment" in content_disposition or content_type not in ["text/plain", "text/html"]:
+                filename = part.get_filename()
+                if filename and not part.is_multipart():
+                    # The bytes parser keeps payloads as ASCII + surrogateescape text
+                    payload = part.get_payload(decode=False).encode('ascii', 'surrogateescape')
+                    encoding = str(part.get('Content-Transfer-Encoding', '7bit')).strip().lower()
+                    try:
+                        attachments.append((_save(payload, encoding, filename), filename))
+                    except Exception as e:
+                        print(f"Failed to save attachment {filename}: {e}")
+    else:
+        try:
+            body = msg.get_payload(decode=True).decode(errors='ignore')
+        except: pass
+    return body, attachments
+
+
+class MimeParser:
+    """
+    Runs all MIME decoding on a small thread pool so large newsletters and
+    attachments never block the event loop. Encoded input is processed in
+    MIME_CHUNK_KB steps and attachments are written to the media store's
+    staging directory as they are decoded, so a part never exists decoded in
+    memory as a whole.
+    """
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {"messages": 0, "parts": 0, "bytes": 0, "active": 0, "errors": 0,
+                      "parse_ms_total": 0.0, "parse_ms_max": 0.0}
+
+    async def _run(self, size: int, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=MIME_PARSE_WORKERS, thread_name_prefix="mime")
+        started = time.perf_counter()
+        self.stats["active"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            self.stats["active"] -= 1
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stats["bytes"] += size
+            self.stats["parse_ms_total"] += elapsed
+            self.stats["parse_ms_max"] = max(self.stats["parse_ms_max"], elapsed)
+
+    async def decode_text(self, raw: bytes, encoding: str, charset: str = 'utf-8') -> str:
+        self.stats["parts"] += 1
+        return await self._run(len(raw), _decode_text, raw, encoding, charset)
+
+    async def save_attachment(self, raw: bytes, encoding: str, filename: str) -> str:
+        """Decode one part to a staging file and return its path"""
+        self.stats["parts"] += 1
+        return await self._run(len(raw), _save, raw, encoding, filename)
+
+    async def parse_message(self, raw: bytes) -> Tuple[str, List[Tuple[str, str]]]:
+        """Parse a whole RFC822 message into (plain text body, [(staging path, file name)])"""
+        self.stats["messages"] += 1
+        return await self._run(len(raw), _parse_message, raw)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        calls = self.stats["messages"] + self.stats["parts"]
+        return {
+            **self.stats,
+            "parse_ms_total": round(self.stats["parse_ms_total"], 1),
+            "parse_ms_max": round(self.stats["parse_ms_max"], 1),
+            "parse_ms_avg": round(self.stats["parse_ms_total"] / calls, 1) if calls else 0.0,
+        }
+
+mime_parser = MimeParser()
@@ -0,0 +1,99 @@
+"""
+MIME Writer - Render outbound e-mail to a file, base64-encoding attachments from disk chunk by chunk
+"""
+import base64
+import mimetypes
+import os
+import uuid
+from email.message import EmailMessage
+from email.policy import SMTP
+from email.utils import formatdate, make_msgid
+from typing import List, Optional, Tuple
+
+# Raw attachment bytes encoded per step: a multiple of 57, so every base64 line is exactly 76 characters
+MIME_ENCODE_CHUNK = 57 * 4096
+# Headers, boundaries and a short text body; what a follow-up message costs besides its attachments
+MESSAGE_OVERHEAD = 16 * 1024
+PART_OVERHEAD = 1024
+
+def encoded_size(size: int) -> int:
+    """Size of size raw bytes once base64-encoded into CRLF-terminated lines"""
+    return 4 * -(-size // 3) + 2 * -(-size // 57)
+
+def plan_batches(attachments: List[Tuple[str, str]], budget: int, body_size: int):
+    """
+    Split (path, filename) attachments into per-message batches that fit the size budget.
+    The first batch shares its message with the body, later ones go out as follow-ups.
+    Returns (batches, dropped) where dropped holds (filename, size) of files too big for any message.
+    """
+    batches: List[List[Tuple[str, str]]] = [[]]
+    dropped: List[Tuple[str, int]] = []
+    used = MESSAGE_OVERHEAD + body_size
+    for path, filename in attachments:
+        size = os.path.getsize(path)
+        cost = encoded_size(size) + PART_OVERHEAD
+        if MESSAGE_OVERHEAD + cost > budget:
+            dropped.append((filename, size))
+            continue
+        if used + cost > budget:
+            # Start a follow-up; the drop check above guarantees the file fits in an empty one
+            batches.append([])
+            used = MESSAGE_OVERHEAD
+        batches[-1].append((path, filename))
+        used += cost
+    return batches, dropped
+
+def _headers(message: EmailMessage) -> bytes:
+    return b"".join(SMTP.fold_binary(name, value) for name, value in message.items()) + b"\r\n"
+
+def _body_part(text: str, html: Optional[str]) -> bytes:
+    body = EmailMessage(policy=SMTP)
+    body.set_content(text)
+    if html is not None:
+        body.add_alternative(html, subtype="html")
+    del body["MIME-Version"]  # Only belongs on the outer message
+    return body.as_bytes()
+
+def _attachment_headers(filename: str) -> bytes:
+    ctype, encoding = mimetypes.guess_type(filename)
+    if ctype is None or encoding is not None:
+        ctype = "application/octet-stream"
+    part = EmailMessage(policy=SMTP)
+    part["Content-Type"] = ctype
+    part.add_header("Content-Disposition", "attachment", filename=filename)
+    part["Content-Transfer-Encoding"] = "base64"
+    return _headers(part)
+
+def write_message(path: str, sender: str, to_email: str, subject: str, text: str,
+                  html: Optional[str] = None, attachments: List[Tuple[str, str]] = ()):
+    """Write a complete multipart/mixed message to path; only one attachment chunk is held in memory"""
+    boundary = f"==={uuid.uuid4().hex}=="
+    outer = EmailMessage(policy=SMTP)
+    outer["From"] = sender
+    outer["To"] = to_email
+    outer["Subject"] = subject
+    outer["Date"] = formatdate(localtime=True)
+    outer["Message-ID"] = make_msgid()
+    outer["MIME-Version"] = "1.0"
+    outer["Content-Type"] = f'multipart/mixed; boundary="{boundary}"'
+    delimiter = f"\r\n--{boundary}\r\n".encode()
+
+    try:
+        with open(path, "wb") as out:
+            out.write(_headers(outer))
+            out.write(delimiter)
+            out.write(_body_part(text, html))
+            for file_path, filename in attachments:
+                out.write(delimiter)
+                out.write(_attachment_headers(filename))
+                with open(file_path, "rb") as f:
+                    while True:
+                        chunk = f.read(MIME_ENCODE_CHUNK)
+                        if not chunk:
+                            break
+                        out.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+            out.write(f"\r\n--{boundary}--\r\n".encode())
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
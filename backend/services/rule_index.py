@@ -0,0 +1,188 @@
+"""
+Rule Index - In-memory compiled forwarding rules per source account
+"""
+import asyncio
+import json
+from typing import Dict, List, Optional
+from database import AsyncSessionLocal, ForwardingRule
+from sqlalchemy import select
+
+WILDCARD = "*"
+
+class CompiledRule:
+    """Detached, pre-parsed view of a ForwardingRule used on the message hot path"""
+    __slots__ = ("id", "name", "source_account_id", "destination_account_id",
+                 "destination_config_json", "destination_config", "forwarding_type",
+                 "interval_minutes", "keys")
+
+    def __init__(self, rule: ForwardingRule):
+        self.id = rule.id
+        self.name = rule.name
+        self.source_account_id = rule.source_account_id
+        self.destination_account_id = rule.destination_account_id
+        self.destination_config_json = rule.destination_config_json
+        self.destination_config = json.loads(rule.destination_config_json) if rule.destination_config_json else {}
+        self.forwarding_type = rule.forwarding_type
+        self.interval_minutes = rule.interval_minutes
+        self.keys = self.compile_filter(rule.source_filter_json)
+
+    @staticmethod
+    def compile_filter(source_filter_json: Optional[str]) -> List[str]:
+        """Return the filter keys of a rule, or [WILDCARD] when it matches everything"""
+        filters = json.loads(source_filter_json) if source_filter_json else []
+        if not isinstance(filters, (list, dict)):
+            filters = [filters]
+        keys = [str(f) for f in filters]
+        if not keys or WILDCARD in keys:
+            return [WILDCARD]
+        return keys
+
+
+class AccountRuleIndex:
+    """Rules of one source account bucketed by filter key plus a wildcard bucket"""
+    def __init__(self):
+        self.rules: Dict[int, CompiledRule] = {}
+        self.by_key: Dict[str, List[CompiledRule]] = {}
+        self.wildcard: List[CompiledRule] = []
+
+    def add(self, rule: CompiledRule):
+        # Copy-on-write, like remove(): lists returned by match() are never mutated,
+        # so a message being processed keeps the rule set it matched
+        self.rules[rule.id] = rule
+        if rule.keys == [WILDCARD]:
+            self.wildcard = sorted(self.wildcard + [rule], key=lambda r: r.id)
+            return
+        for key in rule.keys:
+            self.by_key[key] = sorted(self.by_key.get(key, []) + [rule], key=lambda r: r.id)
+
+    def remove(self, rule_id: int) -> bool:
+        rule = self.rules.pop(rule_id, None)
+        if not rule:
+            return False
+        self.wildcard = [r for r in self.wildcard if r.id != rule_id]
+        for key in rule.keys:
+            bucket = [r for r in self.by_key.get(key, []) if r.id != rule_id]
+            if bucket:
+                self.by_key[key] = bucket
+            else:
+                self.by_key.pop(key, None)
+        return True
+
+    def match(self, key: str) -> List[CompiledRule]:
+        specific = self.by_key.get(key)
+        if not specific:
+            return self.wildcard
+        if not self.wildcard:
+            return specific
+        return sorted(specific + self.wildcard, key=lambda r: r.id)
+
+
+class RuleIndex:
+    """
+    Process-wide cache of enabled forwarding rules keyed by source account.
+    Each account's index is built lazily from the DB on first lookup and then
+    patched in place by the routing router whenever a rule changes.
+    """
+    def __init__(self):
+        self._accounts: Dict[int, AccountRuleIndex] = {}
+        self._versions: Dict[int, int] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.patches = 0
+
+    async def match(self, account_id: int, key: str) -> List[CompiledRule]:
+        """Return enabled rules of an account whose filter matches key (chat id, sender email...)"""
+        index = self._accounts.get(account_id)
+        if index is None:
+            index = await self.rebuild(account_id)
+        rules = index.match(key)
+        if rules:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return rules
+
+    async def get_account_rules(self, account_id: int) -> List[CompiledRule]:
+        """All enabled rules of an account, ordered by id"""
+        index = self._accounts.get(account_id)
+        if index is None:
+            index = await self.rebuild(account_id)
+        return sorted(index.rules.values(), key=lambda r: r.id)
+
+    async def rebuild(self, account_id: int) -> AccountRuleIndex:
+        """(Re)load all enabled rules of an account from the DB"""
+        lock = self._locks.setdefault(account_id, asyncio.Lock())
+        async with lock:
+            while True:
+                version = self._versions.get(account_id, 0)
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        select(ForwardingRule).where(
+                            ForwardingRule.source_account_id == account_id,
+                            ForwardingRule.enabled == True
+                        )
+                    )
+                    rules = result.scalars().all()
+
+                index = AccountRuleIndex()
+                for rule in rules:
+                    try:
+                        index.add(CompiledRule(rule))
+                    except (ValueError, TypeError) as e:
+                        print(f"RuleIndex: Skipping rule {rule.id} with invalid JSON: {e}")
+
+                # A rule changed while we were reading: reload so the patch isn't lost
+                if self._versions.get(account_id, 0) != version:
+                    continue
+                self._accounts[account_id] = index
+                self.rebuilds += 1
+                return index
+
+    def upsert(self, rule: ForwardingRule):
+        """Apply a created or updated rule to any loaded account index"""
+        self.remove(rule.id)
+        self._bump(rule.source_account_id)
+        if not rule.enabled:
+            return
+        index = self._accounts.get(rule.source_account_id)
+        if index is None:
+            return  # Built on first lookup
+        try:
+            index.add(CompiledRule(rule))
+        except (ValueError, TypeError) as e:
+            print(f"RuleIndex: Rule {rule.id} has invalid JSON, dropping from index: {e}")
+        self.patches += 1
+
+    def remove(self, rule_id: int):
+        """Drop a rule from every loaded account index"""
+        for account_id, index in self._accounts.items():
+            if index.remove(rule_id):
+                self._bump(account_id)
+                self.patches += 1
+
+    def invalidate(self, account_id: Optional[int] = None):
+        """Forget one account's index (or all of them); rebuilt on next lookup"""
+        if account_id is None:
+            for acc_id in list(self._accounts):
+                self._bump(acc_id)
+            self._accounts.clear()
+        else:
+            self._bump(account_id)
+            self._accounts.pop(account_id, None)
+
+    def _bump(self, account_id: int):
+        self._versions[account_id] = self._versions.get(account_id, 0) + 1
+
+    def get_stats(self) -> dict:
+        return {
+            "accounts_loaded": len(self._accounts),
+            "rules_loaded": sum(len(i.rules) for i in self._accounts.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rebuilds": self.rebuilds,
+            "patches": self.patches,
+        }
+
+rule_index = RuleIndex()
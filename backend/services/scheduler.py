@@ -7,7 +7,6 @@ from datetime import datetime
 from database import AsyncSessionLocal, ForwardingRule, MessageLog, Account, AccountType
 from sqlalchemy import select
 import asyncio
-import os
 
 class SchedulerService:
     def __init__(self):
@@ -85,12 +84,17 @@ class SchedulerService:
 
             import json
             from services.email_service import send_html_digest
+            from services.log_writer import log_writer
+            from services.media_store import media_store
             
             dest_config = json.loads(rule.destination_config_json) if rule.destination_config_json else {}
             target_email = dest_config.get("email")
             if not target_email:
                 return
 
+            # Make sure rows still buffered by the write-behind writer are visible
+            await log_writer.flush()
+
             # Fetch pending messages for this rule
             msg_res = await db.execute(
                 select(MessageLog).where(
@@ -111,7 +115,7 @@ class SchedulerService:
                 snd = msg.sender_name or "Unknown"
                 if snd not in digest_data: digest_data[snd] = []
                 digest_data[snd].append(msg)
-                if msg.attachment_path and os.path.exists(msg.attachment_path):
+                if media_store.exists(msg.attachment_path):
                     attachments.append(msg.attachment_path)
 
             html_body = f"<div dir='rtl' style='font-family: Tahoma;'><h3>گزارش پیام‌های جدید</h3>"
@@ -122,15 +126,15 @@ class SchedulerService:
                 html_body += "</div>"
             html_body += "</div>"
 
-            success = await send_html_digest(target_email, f"Digest: {rule.name or f'Rule {rule.id}'}", html_body, attachments)
+            success = await send_html_digest(
+                target_email, f"Digest: {rule.name or f'Rule {rule.id}'}", html_body, attachments,
+                smtp_account_id=dest_account.id
+            )
             if success:
                 for m in msgs:
                     m.status = "SENT"
                 await db.commit()
-                # Cleanup attachments
-                for path in attachments:
-                    try: os.remove(path)
-                    except: pass
+                # Blobs no other PENDING row references are now left to the media store GC
 
 # Global instance
 scheduler_service = SchedulerService()
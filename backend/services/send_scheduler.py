@@ -0,0 +1,139 @@
+"""
+Send Scheduler - Per-destination Telegram send lanes that honour FloodWait
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from telethon.errors import FloodWaitError
+from services.token_bucket import TokenBucket
+
+# Per destination chat and per sending account rate limits (messages per second / burst)
+CHAT_SEND_RATE = float(os.getenv("TG_CHAT_SEND_RATE", 1))
+CHAT_SEND_BURST = float(os.getenv("TG_CHAT_SEND_BURST", 3))
+ACCOUNT_SEND_RATE = float(os.getenv("TG_ACCOUNT_SEND_RATE", 20))
+ACCOUNT_SEND_BURST = float(os.getenv("TG_ACCOUNT_SEND_BURST", 20))
+# Give up on a send after this many consecutive flood waits
+MAX_FLOOD_RETRIES = int(os.getenv("TG_MAX_FLOOD_RETRIES", 5))
+
+def on_settled(futures: List[asyncio.Future], callback: Callable[[Optional[BaseException]], None]):
+    """Call callback(error) once every future is done; error is the first failure, None if all succeeded"""
+    remaining = len(futures)
+    errors = []
+    if not futures:
+        callback(None)
+        return
+
+    def done(future: asyncio.Future):
+        nonlocal remaining
+        error = asyncio.CancelledError() if future.cancelled() else future.exception()
+        if error:
+            errors.append(error)
+        remaining -= 1
+        if remaining == 0:
+            callback(errors[0] if errors else None)
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+class Lane:
+    """FIFO of pending sends to one chat from one account"""
+    def __init__(self, account_id: int, chat):
+        self.account_id = account_id
+        self.chat = chat
+        self.jobs: deque = deque()
+        self.bucket = TokenBucket(CHAT_SEND_RATE, CHAT_SEND_BURST)
+        self.task = None
+        self.paused_until = 0.0
+        self.paused_seconds = 0.0
+        self.flood_waits = 0
+        self.sent = 0
+        self.failed = 0
+
+
+class SendScheduler:
+    """
+    Every (destination account, chat) pair gets its own lane and worker task.
+    A FloodWaitError pauses only that lane for the requested time and then
+    retries the same send, so other destinations keep flowing.
+    """
+    def __init__(self):
+        self.lanes: Dict[Tuple[int, str], Lane] = {}
+        self.account_buckets: Dict[int, TokenBucket] = {}
+
+    def submit(self, account_id: int, chat, send: Callable[[], Awaitable]) -> asyncio.Future:
+        """
+        Queue send() on the lane for (account_id, chat) and return a future for its result.
+        Callers don't wait on it (see on_settled): a lane paused by a flood wait must not
+        hold up ingest workers or IMAP polls.
+        """
+        key = (account_id, str(chat))
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = Lane(account_id, chat)
+        future = asyncio.get_running_loop().create_future()
+        lane.jobs.append((send, future))
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._run_lane(lane))
+        return future
+
+    async def _run_lane(self, lane: Lane):
+        account_bucket = self.account_buckets.get(lane.account_id)
+        if account_bucket is None:
+            account_bucket = self.account_buckets[lane.account_id] = TokenBucket(ACCOUNT_SEND_RATE, ACCOUNT_SEND_BURST)
+
+        retries = 0
+        while lane.jobs:
+            send, future = lane.jobs[0]
+            if future.cancelled():
+                lane.jobs.popleft()
+                continue
+            await lane.bucket.acquire()
+            await account_bucket.acquire()
+            try:
+                result = await send()
+            except FloodWaitError as e:
+                retries += 1
+                lane.flood_waits += 1
+                if retries > MAX_FLOOD_RETRIES:
+                    lane.jobs.popleft()
+                    lane.failed += 1
+                    retries = 0
+                    if not future.done(): future.set_exception(e)
+                    continue
+                wait = e.seconds + 1
+                print(f"SendScheduler: Flood wait {e.seconds}s for account {lane.account_id} -> {lane.chat}, pausing lane")
+                lane.paused_until = time.time() + wait
+                await asyncio.sleep(wait)
+                lane.paused_seconds += wait
+                lane.paused_until = 0.0
+                continue
+            except Exception as e:
+                lane.jobs.popleft()
+                lane.failed += 1
+                retries = 0
+                if not future.done(): future.set_exception(e)
+                continue
+            lane.jobs.popleft()
+            lane.sent += 1
+            retries = 0
+            if not future.done(): future.set_result(result)
+
+    def get_stats(self) -> dict:
+        now = time.time()
+        return {
+            f"{lane.account_id}:{lane.chat}": {
+                "backlog": len(lane.jobs),
+                "paused": lane.paused_until > now,
+                "paused_remaining_s": round(max(0.0, lane.paused_until - now), 1),
+                "paused_total_s": round(lane.paused_seconds, 1),
+                "flood_waits": lane.flood_waits,
+                "sent": lane.sent,
+                "failed": lane.failed,
+            }
+            for lane in self.lanes.values()
+        }
+
+send_scheduler = SendScheduler()
@@ -0,0 +1,65 @@
+"""
+Settings Cache - Process-wide immutable snapshot of the AppSettings row
+"""
+import asyncio
+from collections import namedtuple
+from typing import Optional
+from database import AsyncSessionLocal, AppSettings
+from sqlalchemy import select
+
+# Same attribute names as the AppSettings model, but read-only and detached from any session
+SettingsSnapshot = namedtuple("SettingsSnapshot", [column.name for column in AppSettings.__table__.columns])
+
+def snapshot_of(settings: AppSettings) -> SettingsSnapshot:
+    return SettingsSnapshot(**{field: getattr(settings, field) for field in SettingsSnapshot._fields})
+
+
+class SettingsCache:
+    """
+    Loads the AppSettings singleton once and serves it from memory. Every code
+    path that writes the row (PUT /admin/settings, /admin/ssl/*) calls update()
+    or invalidate() afterwards, so readers never need to touch the DB.
+    """
+    def __init__(self):
+        self._snapshot: Optional[SettingsSnapshot] = None
+        self._version = 0
+        self._lock = asyncio.Lock()
+        self.loads = 0
+        self.hits = 0
+        self.invalidations = 0
+
+    async def get(self) -> Optional[SettingsSnapshot]:
+        """The current settings, or None if the row does not exist yet"""
+        snapshot = self._snapshot
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        async with self._lock:
+            while self._snapshot is None:
+                version = self._version
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(select(AppSettings).where(AppSettings.id == 1))
+                    settings = result.scalar_one_or_none()
+                if settings is None:
+                    return None
+                self.loads += 1
+                # Invalidated while we were reading: read again so the update isn't lost
+                if self._version == version:
+                    self._snapshot = snapshot_of(settings)
+            return self._snapshot
+
+    def update(self, settings: AppSettings):
+        """Replace the snapshot with a freshly committed (and refreshed) row"""
+        self._version += 1
+        self._snapshot = snapshot_of(settings)
+        self.invalidations += 1
+
+    def invalidate(self):
+        self._version += 1
+        self._snapshot = None
+        self.invalidations += 1
+
+    def get_stats(self) -> dict:
+        return {"loaded": self._snapshot is not None, "loads": self.loads, "hits": self.hits, "invalidations": self.invalidations}
+
+settings_cache = SettingsCache()
@@ -0,0 +1,189 @@
+"""
+SMTP Pool - Persistent, authenticated SMTP connections reused across sends
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+import aiosmtplib
+from services.token_bucket import TokenBucket
+
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 3))
+# Idle connections are closed after this many seconds (providers drop them anyway)
+SMTP_POOL_IDLE_TIMEOUT = int(os.getenv("SMTP_POOL_IDLE_TIMEOUT", 60))
+# Recycle a connection after this many messages (some relays cap messages per session)
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", 100))
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", 30))
+# Default rate shaping per pool (0 = unlimited); SMTP accounts can override it in their credentials
+SMTP_RATE_PER_MINUTE = float(os.getenv("SMTP_RATE_PER_MINUTE", 0))
+SMTP_RATE_BURST = float(os.getenv("SMTP_RATE_BURST", 5))
+
+def _is_reconnectable(error: Exception) -> bool:
+    """The session is gone (421 service closing, dropped socket): a fresh connection may succeed"""
+    if isinstance(error, (aiosmtplib.SMTPServerDisconnected, aiosmtplib.SMTPConnectError, ConnectionError, OSError)):
+        return True
+    return isinstance(error, aiosmtplib.SMTPResponseException) and error.code == 421
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class PooledConnection:
+    def __init__(self, client: aiosmtplib.SMTP):
+        self.client = client
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """
+    Up to `size` logged-in connections to one SMTP server. send_file() borrows
+    an idle connection (or opens one), and on a 421 or socket error discards it
+    and retries once on a new connection. Connections are recycled after
+    SMTP_MAX_MESSAGES_PER_CONNECTION messages and closed when idle too long.
+    Sends are shaped to rate_per_minute messages (0 = unlimited).
+    """
+    def __init__(self, hostname: str, port: int, username: str, password: str, size: int = SMTP_POOL_SIZE,
+                 use_tls: bool = False, rate_per_minute: float = SMTP_RATE_PER_MINUTE):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_tls = use_tls
+        self.rate_per_minute = rate_per_minute
+        self._bucket = TokenBucket(rate_per_minute / 60, SMTP_RATE_BURST)
+        self._idle: Deque[PooledConnection] = deque()
+        self._slots = asyncio.Semaphore(size)
+        self.stats = {"connects": 0, "reuses": 0, "reconnects": 0, "recycled": 0,
+                      "idle_closed": 0, "sent": 0, "failed": 0, "in_use": 0}
+
+    async def _connect(self) -> PooledConnection:
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname, port=self.port,
+            use_tls=self.use_tls, start_tls=not self.use_tls,  # Implicit TLS (465) or STARTTLS (587)
+            username=self.username, password=self.password, timeout=SMTP_TIMEOUT
+        )
+        await client.connect()  # Also runs TLS and AUTH with the options above
+        self.stats["connects"] += 1
+        return PooledConnection(client)
+
+    async def _acquire(self) -> PooledConnection:
+        while self._idle:
+            conn = self._idle.pop()  # Most recently used first: least likely to have been dropped
+            if conn.client.is_connected and time.monotonic() - conn.last_used < SMTP_POOL_IDLE_TIMEOUT:
+                self.stats["reuses"] += 1
+                return conn
+            await self._close(conn)
+        return await self._connect()
+
+    def _release(self, conn: PooledConnection):
+        conn.last_used = time.monotonic()
+        if conn.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            self.stats["recycled"] += 1
+            asyncio.create_task(self._close(conn))
+        else:
+            self._idle.append(conn)
+
+    @staticmethod
+    async def _close(conn: PooledConnection):
+        try:
+            await asyncio.wait_for(conn.client.quit(), 5)
+        except Exception:
+            conn.client.close()
+
+    async def send_file(self, sender: str, recipients: list, path: str):
+        """Send a message rendered to disk by mime_writer, reconnecting once if the session was lost"""
+        async def operation(client):
+            # Read only once a connection slot is ours: at most `size` rendered messages in memory
+            data = await asyncio.get_running_loop().run_in_executor(None, _read_file, path)
+            return await client.sendmail(sender, recipients, data)
+        return await self._run(operation)
+
+    async def _run(self, operation):
+        await self._bucket.acquire()
+        async with self._slots:
+            self.stats["in_use"] += 1
+            try:
+                conn = await self._acquire()
+                try:
+                    result = await operation(conn.client)
+                except Exception as e:
+                    await self._close(conn)
+                    if not _is_reconnectable(e):
+                        raise
+                    self.stats["reconnects"] += 1
+                    conn = await self._connect()
+                    try:
+                        result = await operation(conn.client)
+                    except Exception:
+                        await self._close(conn)
+                        raise
+                conn.sent += 1
+                self.stats["sent"] += 1
+                self._release(conn)
+                return result
+            except Exception:
+                self.stats["failed"] += 1
+                raise
+            finally:
+                self.stats["in_use"] -= 1
+
+    async def close_idle(self, max_idle: float = SMTP_POOL_IDLE_TIMEOUT):
+        now = time.monotonic()
+        keep = deque()
+        while self._idle:
+            conn = self._idle.popleft()
+            if now - conn.last_used >= max_idle:
+                self.stats["idle_closed"] += 1
+                await self._close(conn)
+            else:
+                keep.append(conn)
+        self._idle = keep
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "idle": len(self._idle), "size": self.size, "rate_per_minute": self.rate_per_minute}
+
+
+class SMTPPoolManager:
+    """
+    One pool per (server, port, user) with its own size and rate: the global
+    settings and every SMTP account get independent pools. Idle connections
+    are reaped in the background.
+    """
+    def __init__(self):
+        self.pools: Dict[Tuple, SMTPPool] = {}
+        self._reaper = None
+
+    def get(self, hostname: str, port: int, username: str, password: str, size: int = SMTP_POOL_SIZE,
+            use_tls: bool = False, rate_per_minute: float = SMTP_RATE_PER_MINUTE) -> SMTPPool:
+        key = (hostname, port, username, password, size, use_tls, rate_per_minute)
+        pool = self.pools.get(key)
+        if pool is None:
+            # Credentials or limits changed: retire pools of the same server and user
+            for old_key in [k for k in self.pools if k[:3] == key[:3]]:
+                asyncio.create_task(self.pools.pop(old_key).close_idle(0))
+            pool = self.pools[key] = SMTPPool(hostname, port, username, password, size, use_tls, rate_per_minute)
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_loop())
+        return pool
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(1, SMTP_POOL_IDLE_TIMEOUT / 2))
+            for pool in list(self.pools.values()):
+                await pool.close_idle()
+
+    async def close_all(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        for pool in self.pools.values():
+            await pool.close_idle(0)
+
+    def get_stats(self) -> dict:
+        return {f"{host}:{port}/{user}": pool.get_stats() for (host, port, user, *_), pool in self.pools.items()}
+
+smtp_pools = SMTPPoolManager()
@@ -3,18 +3,39 @@ Telegram Client Service - Handles Telegram authentication and message monitoring
 """
 import os
 import asyncio
-import json
+from datetime import datetime, timedelta, timezone
 from telethon import TelegramClient, events
 from telethon.errors import SessionPasswordNeededError
 from telethon.tl.types import Channel as TelegramChannel, Chat, User
-from database import AsyncSessionLocal, Source, MessageLog, SourceType, ForwardingRule, Account, AccountType, AppSettings
+from database import AsyncSessionLocal, Source, MessageLog, SourceType, Account, AccountType, TelegramUpdateState
 from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from typing import Optional, List, Dict
-from services.email_service import send_email
+from services.email_spool import email_spool
+from services.rule_index import rule_index
+from services.ingest_queue import ingest_queue, Envelope
+from services.log_writer import log_writer
+from services.lru_cache import LRUCache
+from services.media_handle import MediaHandle
+from services.telegram_forward import native_forwarder, FORWARD_MODE_NATIVE
+from services.send_scheduler import send_scheduler, on_settled
+from services.token_bucket import TokenBucket
+from services.dialog_cache import DialogCache
+from services.settings_cache import settings_cache, SettingsSnapshot
 
 # Determine where to save the session file
 SESSION_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'monitor_session')
 
+# Sender display-name cache sizing
+SENDER_CACHE_SIZE = int(os.getenv("SENDER_CACHE_SIZE", 5000))
+SENDER_CACHE_TTL = int(os.getenv("SENDER_CACHE_TTL", 3600))
+
+# Catch-up after restart: how far back, how many messages and how fast to replay
+CATCHUP_MAX_AGE_HOURS = float(os.getenv("CATCHUP_MAX_AGE_HOURS", 6))
+CATCHUP_MAX_MESSAGES = int(os.getenv("CATCHUP_MAX_MESSAGES", 200))
+CATCHUP_RATE = float(os.getenv("CATCHUP_RATE", 5))
+UPDATE_STATE_FLUSH_SECONDS = int(os.getenv("UPDATE_STATE_FLUSH_SECONDS", 10))
+
 class TelegramService:
     def __init__(self, account_id: int):
         self.account_id = account_id
@@ -23,35 +44,67 @@ class TelegramService:
         self.api_id = None
         self.api_hash = None
         self.phone = None
+        self.sender_cache = LRUCache(SENDER_CACHE_SIZE, SENDER_CACHE_TTL)
+        self.dialogs = DialogCache()
+        self._me_id = None
+        # Update state per chat: id up to which every incoming message was handled, persisted periodically
+        self._last_handled: Dict[str, int] = {}
+        self._in_flight: Dict[str, set] = {}
+        self._highest_done: Dict[str, int] = {}
+        self._dirty_chats = set()
+        self._live_floor: Dict[str, int] = {}
+        # Ids replayed after a restart, by catch-up or from the ingest spill: each is replayed once
+        self._recovered: Dict[str, set] = {}
+        self._state_task = None
+        self._tasks = set()
+        self.catchup_stats = {"replayed": 0, "chats": 0, "running": False}
 
-    async def start(self):
-        """Initializes the client for this specific account."""
-        async with AsyncSessionLocal() as db:
-            # Get global API credentials and account session data
-            settings_res = await db.execute(select(AppSettings).where(AppSettings.id == 1))
-            settings = settings_res.scalar_one_or_none()
-            
-            acc_res = await db.execute(select(Account).where(Account.id == self.account_id))
-            account = acc_res.scalar_one_or_none()
-            
-            if not settings or not settings.telegram_api_id or not account:
-                print(f"Error starting Telegram account {self.account_id}: Settings or Account missing")
-                return
+    async def start(self, settings: Optional[SettingsSnapshot] = None, account: Optional[Account] = None):
+        """Initializes the client for this specific account.
 
-            self.api_id = settings.telegram_api_id
-            self.api_hash = settings.telegram_api_hash
-            
-            session_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sessions', f'account_{self.account_id}')
-            self.client = TelegramClient(session_file, int(self.api_id), self.api_hash)
-            
-            await self.client.connect()
-            self.is_connected = await self.client.is_user_authorized()
+        settings/account may be passed in by the caller (e.g. AccountManager.start_all)
+        to avoid re-reading them for every account.
+        """
+        if settings is None:
+            settings = await settings_cache.get()
+        if account is None:
+            async with AsyncSessionLocal() as db:
+                # Account session data
+                acc_res = await db.execute(select(Account).where(Account.id == self.account_id))
+                account = acc_res.scalar_one_or_none()
             
-            if self.is_connected:
-                print(f"Telegram Account {self.account_id} Authorized and Connected.")
-                self.register_handlers()
-            else:
-                print(f"Telegram Account {self.account_id} NOT Authorized.")
+        if not settings or not settings.telegram_api_id or not account:
+            print(f"Error starting Telegram account {self.account_id}: Settings or Account missing")
+            return
+
+        self.api_id = settings.telegram_api_id
+        self.api_hash = settings.telegram_api_hash
+        
+        session_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'sessions', f'account_{self.account_id}')
+        self.client = TelegramClient(session_file, int(self.api_id), self.api_hash)
+        
+        await self.client.connect()
+        self.is_connected = await self.client.is_user_authorized()
+        
+        if self.is_connected:
+            print(f"Telegram Account {self.account_id} Authorized and Connected.")
+            self.register_handlers()
+            asyncio.create_task(self.warm_sender_cache())
+            self._state_task = asyncio.create_task(self._persist_state_loop())
+            asyncio.create_task(self.catch_up())
+        else:
+            print(f"Telegram Account {self.account_id} NOT Authorized.")
+
+    async def stop(self):
+        """Persist update state and disconnect"""
+        if self._state_task:
+            self._state_task.cancel()
+            try: await self._state_task
+            except asyncio.CancelledError: pass
+            self._state_task = None
+        await self.persist_update_state()
+        if self.client:
+            await self.client.disconnect()
 
     async def send_code(self, phone: str):
         if not self.client: await self.start()
@@ -137,101 +190,387 @@ class TelegramService:
         print(f"Registering handlers for Telegram Account {self.account_id}...")
         @self.client.on(events.NewMessage(incoming=True))
         async def handler(event):
+            if event.message.grouped_id:
+                return  # Part of an album: dispatched as a whole by album_handler
             chat_id = str(event.chat_id)
+            # First live message per chat bounds the catch-up replay from above
+            self._live_floor.setdefault(chat_id, event.id)
+            self._touch_dialog(event)
+            
+            # Find all active rules for THIS account and THIS source chat (in-memory, no DB round-trip)
+            matched_rules = await rule_index.match(self.account_id, chat_id)
             
+            if matched_rules:
+                # Hand off to the forwarding workers; never block update processing on SMTP/media
+                await self.dispatch(Envelope(self.account_id, chat_id, event.id, event.message, matched_rules))
+            else:
+                self.mark_handled(chat_id, event.id)
+
+        @self.client.on(events.Album)
+        async def album_handler(event):
+            messages = sorted(event.messages, key=lambda m: m.id)
+            self._touch_dialog(event)
+            if messages[0].out:
+                return
+            chat_id = str(event.chat_id)
+            self._live_floor.setdefault(chat_id, messages[0].id)
+            matched_rules = await rule_index.match(self.account_id, chat_id)
+            if matched_rules:
+                # One envelope for the whole album, so one worker forwards it in a single call
+                await self.dispatch(Envelope(self.account_id, chat_id, messages[0].id, messages[0], matched_rules, album=messages))
+            else:
+                for message in messages:
+                    self.mark_handled(chat_id, message.id)
+
+        @self.client.on(events.NewMessage(outgoing=True))
+        async def outgoing_handler(event):
+            self._touch_dialog(event)
+
+        @self.client.on(events.ChatAction)
+        async def chat_action_handler(event):
+            chat_id = str(event.chat_id)
+            if (event.user_left or event.user_kicked) and event.user_id == self._me_id:
+                self.dialogs.remove(chat_id)
+            else:
+                self._touch_dialog(event)
+
+    def _touch_dialog(self, event):
+        """Keep the dialog cache ordered by activity; resolve unknown chats off the handler path"""
+        if not self.dialogs.loaded:
+            return
+        chat_id = str(event.chat_id)
+        if not self.dialogs.touch(chat_id, event.chat):
+            async def resolve():
+                try:
+                    self.dialogs.touch(chat_id, await event.get_chat())
+                except Exception as e:
+                    print(f"Telegram Account {self.account_id}: Could not resolve new chat {chat_id}: {e}")
+            asyncio.create_task(resolve())
+
+    async def handle_album(self, messages, matched_rules=None):
+        """Run the pipeline for every message of an album at once, so native forwards are batched"""
+        results = await asyncio.gather(
+            *(self.handle_message(message, matched_rules, album_size=len(messages)) for message in messages),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def handle_message(self, message, matched_rules=None, album_size: int = 1):
+        """Run the forwarding pipeline for one incoming message (called by ingest workers)"""
+        chat_id = str(message.chat_id)
+        media = None
+        started = 0
+        cancelled = False
+        try:
+            if matched_rules is None:
+                matched_rules = await rule_index.match(self.account_id, chat_id)
+            if not matched_rules:
+                return
+
+            sender_name = await self.get_sender_name(message)
+            
+            # One shared, lazily downloaded copy of the media for every matched rule
+            media = MediaHandle(message, consumers=len(matched_rules)) if message.media else None
+            
+            # Log message for EACH matched rule (or once per message? let's do once per rule for clarity in logs)
+            for rule in matched_rules:
+                print(f"🎯 Rule {rule.id} matched for message in {chat_id}")
+                started += 1  # process_forwarding consumes this rule's media reference, even if it raises
+                await self.process_forwarding(rule, message, sender_name, media, album_size)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            # A failing rule ends the loop early: give back the references of the rules that never ran
+            if media and started < len(matched_rules):
+                media.release(len(matched_rules) - started)
+            # Failed messages aren't replayed either: they must not hold back the update state.
+            # Interrupted ones stay in flight, so the persisted state lets catch-up replay them
+            if not cancelled:
+                self.mark_handled(chat_id, message.id)
+
+    async def dispatch(self, envelope: Envelope):
+        """Queue an envelope for the ingest workers; its messages hold back the update state until handled"""
+        self._in_flight.setdefault(envelope.chat_id, set()).update(envelope.album_ids or [envelope.message_id])
+        await ingest_queue.put(envelope)
+
+    def adopt(self, chat_id: str, message_ids: List[int]) -> List[int]:
+        """Take over ids spilled by the previous run; returns those catch-up hasn't replayed already"""
+        recovered = self._recovered.setdefault(chat_id, set())
+        fresh = [message_id for message_id in message_ids if message_id not in recovered]
+        recovered.update(fresh)
+        if fresh:
+            self._in_flight.setdefault(chat_id, set()).update(fresh)
+        return fresh
+
+    def mark_handled(self, chat_id: str, message_id: int):
+        """
+        Workers finish out of order, so the persisted id only advances up to the oldest
+        message of the chat still in flight: catch-up after a crash resumes from there.
+        """
+        in_flight = self._in_flight.get(chat_id)
+        if in_flight:
+            in_flight.discard(message_id)
+        done = self._highest_done[chat_id] = max(message_id, self._highest_done.get(chat_id, 0))
+        if in_flight:
+            done = min(done, min(in_flight) - 1)
+        else:
+            self._in_flight.pop(chat_id, None)
+        if done > self._last_handled.get(chat_id, 0):
+            self._last_handled[chat_id] = done
+            self._dirty_chats.add(chat_id)
+
+    async def persist_update_state(self):
+        """Upsert the last handled message id of every chat that changed since the last call"""
+        if not self._dirty_chats:
+            return
+        dirty, self._dirty_chats = self._dirty_chats, set()
+        try:
             async with AsyncSessionLocal() as db:
-                # Find all active rules for THIS account and THIS source chat
-                result = await db.execute(
-                    select(ForwardingRule).where(
-                        ForwardingRule.source_account_id == self.account_id,
-                        ForwardingRule.enabled == True
+                for chat_id in dirty:
+                    stmt = sqlite_insert(TelegramUpdateState).values(
+                        account_id=self.account_id, chat_id=chat_id, last_message_id=self._last_handled[chat_id]
                     )
-                )
-                rules = result.scalars().all()
-                
-                matched_rules = []
-                for rule in rules:
-                    # Check if filters match (simplistic for now: if filter is None or chat_id is in list)
-                    filters = json.loads(rule.source_filter_json) if rule.source_filter_json else []
-                    if not filters or chat_id in filters or "*" in filters:
-                        matched_rules.append(rule)
-                
-                if matched_rules:
-                    sender = await event.get_sender()
-                    sender_name = getattr(sender, 'first_name', None) or getattr(sender, 'title', None) or "Unknown"
-                    
-                    # Log message for EACH matched rule (or once per message? let's do once per rule for clarity in logs)
-                    for rule in matched_rules:
-                        # Process forwarding based on destination account...
-                        # This part will be expanded in the unified worker service
-                        print(f"🎯 Rule {rule.id} matched for message in {chat_id}")
-                        # (Forwarding logic will be moved to a shared method)
-                        await self.process_forwarding(rule, event, sender_name)
-                    
-                    await db.commit()
+                    await db.execute(stmt.on_conflict_do_update(
+                        index_elements=["account_id", "chat_id"],
+                        set_={"last_message_id": stmt.excluded.last_message_id, "updated_at": datetime.now(timezone.utc)}
+                    ))
+                await db.commit()
+        except Exception as e:
+            self._dirty_chats |= dirty
+            print(f"Telegram Account {self.account_id}: Failed to persist update state: {e}")
 
-    async def process_forwarding(self, rule, event, sender_name):
-        """Handle actual forwarding based on rule destination"""
-        
+    async def _persist_state_loop(self):
+        while True:
+            await asyncio.sleep(UPDATE_STATE_FLUSH_SECONDS)
+            await self.persist_update_state()
+
+    async def catch_up(self):
+        """
+        Replay messages that arrived while we were offline through the normal rule pipeline.
+        Bounded by CATCHUP_MAX_AGE_HOURS and CATCHUP_MAX_MESSAGES, paced at CATCHUP_RATE msg/s.
+        Only chats with a persisted state are considered; newly joined chats start live.
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(TelegramUpdateState).where(TelegramUpdateState.account_id == self.account_id))
+            states = result.scalars().all()
+        if not states:
+            return
+
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=CATCHUP_MAX_AGE_HOURS)
+        bucket = TokenBucket(CATCHUP_RATE, CATCHUP_RATE)
+        remaining = CATCHUP_MAX_MESSAGES
+        # Messages still waiting in the ingest spill are replayed from there
+        spilled = ingest_queue.restored_ids(self.account_id)
+        self.catchup_stats["running"] = True
+        try:
+            # Most recently active chats first
+            for state in sorted(states, key=lambda st: st.updated_at or datetime.min, reverse=True):
+                if remaining <= 0:
+                    break
+                self._last_handled.setdefault(state.chat_id, state.last_message_id)
+                rules = await rule_index.match(self.account_id, state.chat_id)
+                if not rules:
+                    continue
+                replayed = 0
+                album = []
+                skip = spilled.get(state.chat_id, set())
+                recovered = self._recovered.setdefault(state.chat_id, set())
+
+                async def queue_messages(messages):
+                    await bucket.acquire()
+                    if len(messages) > 1:
+                        await self.dispatch(Envelope(self.account_id, state.chat_id, messages[0].id, messages[0], rules, album=messages))
+                    else:
+                        await self.dispatch(Envelope(self.account_id, state.chat_id, messages[0].id, messages[0], rules))
+
+                async for msg in self.client.iter_messages(
+                    int(state.chat_id), min_id=state.last_message_id, offset_date=cutoff, reverse=True, limit=remaining
+                ):
+                    floor = self._live_floor.get(state.chat_id)
+                    if floor and msg.id >= floor:
+                        break  # Delivered live already
+                    if msg.out or msg.date < cutoff or msg.id in skip or msg.id in recovered:
+                        continue
+                    recovered.add(msg.id)
+                    # Albums come out as consecutive messages: collect them into one envelope
+                    if album and (not msg.grouped_id or msg.grouped_id != album[0].grouped_id):
+                        await queue_messages(album)
+                        album = []
+                    if msg.grouped_id:
+                        album.append(msg)
+                    else:
+                        await queue_messages([msg])
+                    replayed += 1
+                if album:
+                    await queue_messages(album)
+                remaining -= replayed
+                if replayed:
+                    self.catchup_stats["chats"] += 1
+                    self.catchup_stats["replayed"] += replayed
+                    print(f"Telegram Account {self.account_id}: Caught up {replayed} missed messages in {state.chat_id}")
+        except Exception as e:
+            print(f"Telegram Account {self.account_id}: Catch-up failed: {e}")
+        finally:
+            self.catchup_stats["running"] = False
+
+    async def get_sender_name(self, message) -> str:
+        """Resolve a message sender's display name, avoiding get_sender() round-trips"""
+        sender_id = message.sender_id
+        if sender_id is not None:
+            cached = self.sender_cache.get(sender_id)
+            if cached is not None:
+                return cached
+        sender = await message.get_sender()
+        sender_name = getattr(sender, 'first_name', None) or getattr(sender, 'title', None) or "Unknown"
+        if sender_id is not None and sender is not None:
+            self.sender_cache.set(sender_id, sender_name)
+        return sender_name
+
+    async def warm_sender_cache(self):
+        """Load the dialog cache and pre-populate the sender cache in the same pass"""
+        def remember(dialog):
+            if len(self.sender_cache) < self.sender_cache.maxsize:
+                entity = dialog.entity
+                name = getattr(entity, 'first_name', None) or getattr(entity, 'title', None) or "Unknown"
+                self.sender_cache.set(dialog.id, name)
+
+        try:
+            me = await self.client.get_me()
+            self._me_id = me.id if me else None
+            await self.dialogs.ensure_loaded(self.client, on_dialog=remember)
+        except Exception as e:
+            print(f"Telegram Account {self.account_id}: Failed to load dialogs: {e}")
+            return
+        print(f"Telegram Account {self.account_id}: Sender cache warmed with {len(self.sender_cache)} entries")
+
+    async def process_forwarding(self, rule, message, sender_name, media: Optional[MediaHandle] = None, album_size: int = 1):
+        """Handle actual forwarding based on rule destination. Consumes one reference of media."""
+        handed_off = False
+        try:
+            handed_off = await self._forward_by_rule(rule, message, sender_name, media, album_size)
+        finally:
+            if media and not handed_off:
+                media.release()
+
+    async def _forward_by_rule(self, rule, message, sender_name, media: Optional[MediaHandle], album_size: int) -> bool:
+        """Returns True when a background delivery took over the media reference"""
         async with AsyncSessionLocal() as db:
             dest_acc_res = await db.execute(select(Account).where(Account.id == rule.destination_account_id))
             dest_account = dest_acc_res.scalar_one_or_none()
             
-            if not dest_account: return
+        if not dest_account: return False
 
-            dest_config = json.loads(rule.destination_config_json) if rule.destination_config_json else {}
-            attachment_path = None
-            
-            # Handle Media Download if needed (Instant only, or for Digest logging)
-            if event.media and rule.forwarding_type == "digest":
-                # For digests, we must save the file locally
-                media_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'media')
-                os.makedirs(media_dir, exist_ok=True)
-                attachment_path = await event.download_media(file=media_dir)
-
-            log = MessageLog(
-                rule_id=rule.id,
-                source_account_id=self.account_id,
-                message_id=str(event.id),
-                sender_name=sender_name,
-                message_content=event.text[:1000] if event.text else "",
-                attachment_path=attachment_path,
-                status="PENDING" if rule.forwarding_type == "digest" else "PROCESSING"
-            )
-            db.add(log)
-            await db.flush() # Get ID
-
-            if rule.forwarding_type == "instant":
-                if dest_account.account_type in [AccountType.EMAIL_SMTP, AccountType.EMAIL_IMAP]:
-                    # Forward to Email
-                    target_email = dest_config.get("email")
-                    if target_email:
-                        subject = f"Forward: {sender_name}"
-                        body = f"From Account {self.account_id}\nSender: {sender_name}\n\n{event.text}"
-                        # Download temporary for instant email if media exists
-                        temp_path = None
-                        if event.media: temp_path = await event.download_media()
-                        success = await send_email(target_email, subject, body, [temp_path] if temp_path else [])
-                        log.status = "SENT" if success else "FAILED"
-                        if temp_path and os.path.exists(temp_path): os.remove(temp_path)
-                
-                elif dest_account.account_type == AccountType.TELEGRAM:
-                    # Messenger to Messenger!
-                    target_chat = dest_config.get("chat_id")
-                    if target_chat:
-                        # We need the client for the destination account...
-                        from services.account_manager import account_manager
-                        dest_client = await account_manager.get_client(dest_account.id)
-                        if dest_client:
-                            try:
-                                await dest_client.send_message(
-                                    int(target_chat) if target_chat.startswith("-") or target_chat.isdigit() else target_chat, 
-                                    f"**Forwarded from Account {self.account_id}**\n_Sender: {sender_name}_\n\n{event.text}",
-                                    file=event.media if event.media else None
-                                )
-                                log.status = "SENT"
-                            except Exception as e:
-                                print(f"Failed messenger-to-messenger: {e}")
-                                log.status = "FAILED"
+        dest_config = rule.destination_config
+        to_email = dest_account.account_type in [AccountType.EMAIL_SMTP, AccountType.EMAIL_IMAP]
+        attachment_path = None
+        media_ref = None
+        skip_reason = None
+        
+        # Media decision first (digests and emails need the file), so a skip placeholder reaches the log row
+        if media and (rule.forwarding_type == "digest" or to_email):
+            media_ref = await media.get_ref()
+            skip_reason = media.skip_reason
+        elif media and dest_config.get("forward_mode") != FORWARD_MODE_NATIVE:
+            # Copy mode re-sends the media by reference: nothing is downloaded, but the same limits apply
+            skip_reason = await media.check()
+        if rule.forwarding_type == "digest":
+            # The PENDING digest row's ref keeps the blob alive until the digest is sent
+            attachment_path = media_ref
+
+        message_content = message.text[:1000] if message.text else ""
+        if skip_reason:
+            message_content = f"{message_content}\n{media.placeholder}".strip()
+
+        # Write-behind: the row is committed with the next log_writer batch
+        log = log_writer.add(MessageLog(
+            rule_id=rule.id,
+            source_account_id=self.account_id,
+            message_id=str(message.id),
+            sender_name=sender_name,
+            message_content=message_content,
+            attachment_path=attachment_path,
+            status="PENDING" if rule.forwarding_type == "digest" else "PROCESSING"
+        ))
+
+        if rule.forwarding_type == "instant":
+            if to_email:
+                # Forward to Email
+                target_email = dest_config.get("email")
+                if target_email:
+                    subject = f"Forward: {sender_name}"
+                    body = f"From Account {self.account_id}\nSender: {sender_name}\n\n{message.text}"
+                    # media_ref: shared download, pinned in the media store until every rule is done with it
+                    if media and media.skip_reason:
+                        body += f"\n\n{media.placeholder}"
+                    # Delivered (and retried) by the spool workers; the log stays QUEUED until then
+                    email_spool.enqueue(target_email, subject, body, [media_ref] if media_ref else [],
+                                        log=log, smtp_account_id=dest_account.id)
             
-            await db.commit()
+            elif dest_account.account_type == AccountType.TELEGRAM:
+                # Messenger to Messenger!
+                target_chat = dest_config.get("chat_id")
+                if target_chat:
+                    # We need the client for the destination account...
+                    from services.account_manager import account_manager
+                    dest_client = await account_manager.get_client(dest_account.id)
+                    if dest_client:
+                        target = int(target_chat) if target_chat.startswith("-") or target_chat.isdigit() else target_chat
+                        text = f"**Forwarded from Account {self.account_id}**\n_Sender: {sender_name}_\n\n{message.text}"
+                        if dest_config.get("forward_mode") == FORWARD_MODE_NATIVE:
+                            # Server-side forward: no media bytes pass through this box. The outcome is
+                            # awaited in the background (a paused lane must not hold this worker)
+                            forwarded = native_forwarder.forward(
+                                dest_client, dest_account.id, target, int(message.chat_id), message, album_size, rule.id
+                            )
+                            self._background(self._finish_native_forward(forwarded, dest_client, dest_account.id, target, text, message, media, log))
+                            return True
+                        file = message.media
+                        if skip_reason:
+                            # Over the limits: the placeholder goes out instead of the media
+                            text += f"\n\n{media.placeholder}"
+                            file = None
+                        # Paced per destination chat; flood waits pause the lane instead of failing
+                        sent = send_scheduler.submit(dest_account.id, target, lambda: dest_client.send_message(
+                            target, 
+                            text,
+                            file=file
+                        ))
+                        on_settled([sent], lambda error: self._settle_log(log, error))
+        return False
+
+    async def _finish_native_forward(self, forwarded, dest_client, dest_account_id: int, target, text: str,
+                                     message, media: Optional[MediaHandle], log):
+        """Settle a native forward; restricted chats are copied instead. Releases the media reference."""
+        try:
+            if await forwarded:
+                self._settle_log(log, None)
+                return
+            # Restricted chat: copy by re-uploading the shared download under its own name
+            file = message.media
+            if media:
+                path = await media.get_path()
+                file = await dest_client.upload_file(path, file_name=media.filename) if path else None
+                if media.skip_reason:
+                    text += f"\n\n{media.placeholder}"
+            sent = send_scheduler.submit(dest_account_id, target, lambda: dest_client.send_message(target, text, file=file))
+            on_settled([sent], lambda error: self._settle_log(log, error))
+        except Exception as e:
+            self._settle_log(log, e)
+        finally:
+            if media:
+                media.release()
+
+    @staticmethod
+    def _settle_log(log, error: Optional[BaseException]):
+        if error:
+            print(f"Failed messenger-to-messenger: {error}")
+        log_writer.set_status(log, "FAILED" if error else "SENT")
+
+    def _background(self, coro):
+        # Keep a reference: the event loop only holds weak references to tasks
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
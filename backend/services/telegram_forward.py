@@ -0,0 +1,94 @@
+"""
+Telegram Forward - Native server-side forwarding with album batching
+"""
+import asyncio
+import os
+from typing import Dict, List, Optional, Tuple
+from telethon.errors import (
+    ChatForwardsRestrictedError, MessageIdInvalidError, ChannelPrivateError, PeerIdInvalidError
+)
+from services.send_scheduler import send_scheduler
+
+# Rule destination_config_json: {"chat_id": "...", "forward_mode": "native"} (default "copy")
+FORWARD_MODE_NATIVE = "native"
+FORWARD_MODE_COPY = "copy"
+
+# How long to collect the messages of one album (same grouped_id) before forwarding
+ALBUM_BATCH_WINDOW = int(os.getenv("ALBUM_BATCH_WINDOW_MS", 800)) / 1000
+
+# Errors meaning "a native forward is not possible here": the caller copies instead.
+# ValueError is raised by Telethon when the destination account cannot resolve the source peer.
+FALLBACK_ERRORS = (ChatForwardsRestrictedError, MessageIdInvalidError, ChannelPrivateError, PeerIdInvalidError, ValueError)
+
+class NativeForwarder:
+    """
+    Forwards messages with Telegram's forward API so media is never re-uploaded
+    through this server. Messages sharing a grouped_id (albums) are combined
+    into a single forward call, sent as soon as album_size messages have arrived
+    or after ALBUM_BATCH_WINDOW at the latest.
+    """
+    def __init__(self):
+        self._batches: Dict[Tuple, dict] = {}
+        self.forward_calls = 0
+        self.forwarded_messages = 0
+        self.fallbacks = 0
+
+    def forward(self, client, account_id: int, target, from_peer, message, album_size: int = 1,
+                rule_id: Optional[int] = None) -> asyncio.Future:
+        """
+        Queue a forward of one message to target. Albums are batched per rule, so two rules
+        sharing a destination each get their own copy. The returned future resolves to False
+        when forwarding is restricted and the caller should fall back to copy mode;
+        other errors are set on it.
+        """
+        grouped_id = getattr(message, "grouped_id", None)
+        if not grouped_id:
+            return asyncio.ensure_future(self._forward(client, account_id, target, from_peer, [message.id]))
+
+        key = (rule_id, account_id, target, from_peer, grouped_id)
+        batch = self._batches.get(key)
+        flush = lambda: asyncio.create_task(self._flush(key, client, account_id, target, from_peer))
+        if batch is None:
+            loop = asyncio.get_running_loop()
+            batch = {"ids": [], "future": loop.create_future()}
+            self._batches[key] = batch
+            batch["timer"] = loop.call_later(ALBUM_BATCH_WINDOW, flush)
+        batch["ids"].append(message.id)
+        if len(batch["ids"]) >= album_size > 1:
+            # The whole album is here (handle_album dispatches it together): don't wait for the window
+            batch["timer"].cancel()
+            flush()
+        return batch["future"]
+
+    async def _flush(self, key, client, account_id, target, from_peer):
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        try:
+            batch["future"].set_result(await self._forward(client, account_id, target, from_peer, sorted(batch["ids"])))
+        except Exception as e:
+            batch["future"].set_exception(e)
+
+    async def _forward(self, client, account_id: int, target, from_peer, message_ids: List[int]) -> bool:
+        try:
+            self.forward_calls += 1
+            await send_scheduler.submit(
+                account_id, target,
+                lambda: client.forward_messages(target, message_ids, from_peer=from_peer)
+            )
+            self.forwarded_messages += len(message_ids)
+            return True
+        except FALLBACK_ERRORS as e:
+            self.fallbacks += 1
+            print(f"Native forward of {message_ids} from {from_peer} not possible ({e}), falling back to copy")
+            return False
+
+    def get_stats(self) -> dict:
+        return {
+            "forward_calls": self.forward_calls,
+            "forwarded_messages": self.forwarded_messages,
+            "fallbacks": self.fallbacks,
+            "pending_albums": len(self._batches),
+        }
+
+native_forwarder = NativeForwarder()